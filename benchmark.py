@@ -0,0 +1,353 @@
+# benchmark.py
+# Benchmarks of the jds6600 protocol layer and the sweep loop of bode.py, running against the simulated instruments
+
+# Jan Böhmer (c) 2019
+# published under MIT license. See file "LICENSE" for full license text
+
+import argparse
+import contextlib
+import datetime
+import io
+import itertools
+import json
+import os
+import platform
+import runpy
+import shlex
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import simulator
+from jds6600 import jds6600
+
+BODE_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bode.py")
+
+
+def git_revision():
+    """Returns the git revision of the checked out program (None if unknown), so results of different releases can be compared."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(BODE_PY),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_operation(function, port, iterations):
+    """
+    Calls function iterations times and measures the time per call.
+    The simulated I/O time (latency of the port) is separated from the time spent in Python.
+    """
+    # Warm up (and fill caches, if enabled)
+    function()
+
+    io_before = port.io_time if port else 0.0
+    transactions_before = port.transactions if port else 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    elapsed = time.perf_counter() - start
+    io_time = (port.io_time - io_before) if port else 0.0
+    transactions = (port.transactions - transactions_before) if port else 0
+
+    return {
+        "iterations": iterations,
+        "per_op_s": elapsed / iterations,
+        "io_per_op_s": io_time / iterations,
+        "python_per_op_s": (elapsed - io_time) / iterations,
+        "transactions_per_op": transactions / iterations,
+    }
+
+
+def bench_protocol(latency, iterations):
+    """Benchmarks single operations of the jds6600 class, every one with a new simulated device."""
+    wave = [int(2047 + 2047 * np.sin(2 * np.pi * n / 2048)) for n in range(2048)]
+    reply = ":b01=" + ",".join(str(v) for v in wave) + ",."
+    freqs = iter(np.tile(np.logspace(1, 6, 1000), 10000))
+    flips = itertools.cycle((False, True))
+
+    # name, function of the jds6600 object, use the register cache, number of iterations
+    # (the name mangled private functions of the protocol layer are called directly)
+    operations = [
+        ("parsereply_register", lambda awg: awg._jds6600__parsereply(23, b":r23=100000,0.\r\n"), False, iterations * 100),
+        ("parsedata_arbwave", lambda awg: awg._jds6600__parsedata("01", reply, 1), False, iterations * 10),
+        ("getfrequency", lambda awg: awg.getfrequency(1), False, iterations),
+        ("setfrequency", lambda awg: awg.setfrequency(1, float(next(freqs))), False, iterations),
+        ("setfrequency_cached", lambda awg: awg.setfrequency(1, float(next(freqs))), True, iterations),
+        ("getstate", lambda awg: awg.getstate(), False, iterations),
+        # with the cache, so the mode check of setfrequency() does not end the transaction (see jds6600 Part 14)
+        ("transaction_3_writes", lambda awg: transaction(awg, float(next(freqs)), next(flips)), True, iterations),
+        ("arb_getwave", lambda awg: awg.arb_getwave(1), False, max(iterations // 10, 1)),
+        ("arb_getwave_array", lambda awg: awg.arb_getwave_array(1), False, max(iterations // 10, 1)),
+        ("arb_getall", lambda awg: awg.arb_getall(), False, 1),
+        ("arb_setwave", lambda awg: awg.arb_setwave(1, wave), False, max(iterations // 10, 1)),
+        ("arb_setwave_cached", lambda awg: awg.arb_setwave(1, wave), True, max(iterations // 10, 1)),
+    ]
+
+    results = {}
+    for name, function, cache, count in operations:
+        port = simulator.SimulatedJDS6600(latency=latency)
+        awg = jds6600(port, cache=cache)
+        results[name] = bench_operation(lambda: function(awg), port, count)
+    return results
+
+
+class ReplayPort:
+    """
+    A serial.Serial like object, which answers every write with a fixed reply without any delay or simulation.
+    With it only the time of the protocol layer (formatting commands and parsing replies) is measured.
+    The calls of read() are counted, readline() reads byte by byte like the one of serial.Serial.
+    """
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.is_open = True
+        self.port = "replay"
+        self.timeout = 1
+        self.data = b""
+        self.reads = 0
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def write(self, data):
+        self.data = self.reply
+        return len(data)
+
+    def read(self, size=1):
+        self.reads += 1
+        data, self.data = self.data[:size], self.data[size:]
+        return data
+
+    def readline(self):
+        line = b""
+        while not line.endswith(b"\n"):
+            data = self.read(1)
+            if not data:
+                break
+            line += data
+        return line
+
+    def reset_input_buffer(self):
+        self.data = b""
+
+
+def legacy_regtxt(reg):
+    return "0" + str(reg) if reg < 10 else str(reg)
+
+
+def legacy_write(port, reg, val):
+    """Register write like jds6600 did it before the codec: formatted as str, the "ok" read with readline() and decoded."""
+    port.write((":w" + legacy_regtxt(reg) + "=" + str(val) + "." + chr(0x0a)).encode())
+    ret = str(port.readline(), "utf-8").rstrip()
+    if ret != ":ok":
+        raise ValueError(ret)
+
+
+def legacy_parse(awg, reg, line):
+    """Parses a register reply like jds6600 did it before the codec: decoded and split as str."""
+    values = awg._jds6600__parsedata(legacy_regtxt(reg), str(line, "utf-8").rstrip(), 0)
+    return int(values[0]) if len(values) == 1 else [int(v) for v in values]
+
+
+def legacy_read(awg, port, reg, n=1):
+    """Read of n registers like jds6600 did it before the codec: formatted as str, every reply read with readline()."""
+    port.write((":r" + legacy_regtxt(reg) + "=" + str(n - 1) + "." + chr(0x0a)).encode())
+    ret = [legacy_parse(awg, reg + i, port.readline()) for i in range(n)]
+    return ret[0] if n == 1 else ret
+
+
+def bench_codec(iterations):
+    """
+    Benchmarks the Python overhead of single register transactions (command formatting, reply reading and parsing)
+    against a port which answers instantly, compared with the way jds6600 did this before (the legacy path).
+    """
+    read_4 = b":r23=100000,0.\r\n:r24=100000,0.\r\n:r25=5000.\r\n:r26=5000.\r\n"
+
+    # name, reply of the port, function of the jds6600 object and the port, the same done by the legacy path
+    # (the name mangled private functions are called directly)
+    operations = [
+        ("parse_register", b"", lambda awg, port: awg._jds6600__parsereply(23, b":r23=100000,0.\r\n"),
+         lambda awg, port: legacy_parse(awg, 23, b":r23=100000,0.\r\n")),
+        ("read_register", b":r23=100000,0.\r\n", lambda awg, port: awg._jds6600__getdata(23),
+         lambda awg, port: legacy_read(awg, port, 23)),
+        ("read_4_registers", read_4, lambda awg, port: awg._jds6600__getdata(23, 4),
+         lambda awg, port: legacy_read(awg, port, 23, 4)),
+        ("write_register", b":ok\r\n", lambda awg, port: awg._jds6600__sendwritecmd(23, b"100000,0"),
+         lambda awg, port: legacy_write(port, 23, "100000,0")),
+        ("write_register_int", b":ok\r\n", lambda awg, port: awg._jds6600__sendwritecmd(25, 5000),
+         lambda awg, port: legacy_write(port, 25, 5000)),
+    ]
+
+    results = {}
+    for name, reply, function, legacy in operations:
+        result = {}
+        for path, run in (("new", function), ("legacy", legacy)):
+            port = ReplayPort(reply)
+            awg = jds6600(port)
+            result[path] = bench_operation(lambda: run(awg, port), None, iterations)
+            reads = port.reads
+            run(awg, port)
+            result[path]["reads_per_op"] = port.reads - reads
+        result["speedup"] = result["legacy"]["per_op_s"] / result["new"]["per_op_s"]
+        results[name] = result
+    return results
+
+
+def transaction(awg, freq, flip):
+    """
+    Writes waveform, amplitude and frequency in one transaction (like the setup in bode.py).
+    flip selects between two waveforms and amplitudes, so no write is skipped by the cache.
+    """
+    with awg.transaction():
+        awg.setwaveform(1, "square" if flip else "sine")
+        awg.setamplitude(1, 4 if flip else 5)
+        awg.setfrequency(1, freq)
+
+
+def bench_sweep(points, latency, bode_args):
+    """
+    Runs a full sweep of bode.py with the given number of points against the simulated instruments.
+    The time is split into simulated I/O, waiting (sleeps of bode.py) and the time spent in Python.
+    """
+    instruments = []
+    classes = (simulator.SimulatedJDS6600, simulator.SimulatedDS1054Z)
+
+    def recording(cls):
+        def create(*args, **kwargs):
+            instrument = cls(*args, **kwargs)
+            instruments.append(instrument)
+            return instrument
+        return create
+
+    slept = [0.0]
+    sleep = time.sleep
+
+    def counting_sleep(seconds):
+        slept[0] += seconds
+        sleep(seconds)
+
+    argv = ["bode.py", "100", "100000", str(points), "--no_plots", "--simulate", "rc",
+            "--sim_latency", str(latency), "--output", os.devnull] + bode_args
+
+    old_argv = sys.argv
+    simulator.SimulatedJDS6600, simulator.SimulatedDS1054Z = (recording(cls) for cls in classes)
+    time.sleep = counting_sleep
+    sys.argv = argv
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                runpy.run_path(BODE_PY, run_name="__main__")
+            except SystemExit as e:
+                # bode.py exits after writing the output when no plots are shown
+                if e.code:
+                    raise
+        elapsed = time.perf_counter() - start
+    finally:
+        simulator.SimulatedJDS6600, simulator.SimulatedDS1054Z = classes
+        time.sleep = sleep
+        sys.argv = old_argv
+
+    awg_port, scope = instruments
+    io_time = awg_port.io_time + scope.io_time
+
+    return {
+        "points": points,
+        "args": " ".join(argv[1:]),
+        "elapsed_s": elapsed,
+        "points_per_s": points / elapsed,
+        "io_s": io_time,
+        "wait_s": slept[0] - io_time,
+        "python_s": elapsed - slept[0],
+        "python_per_point_s": (elapsed - slept[0]) / points,
+        "awg_transactions": awg_port.transactions,
+        "scope_commands": scope.commands,
+    }
+
+
+def bench_startup(repeat, target):
+    """
+    Measures the time of a headless run of bode.py with 3 points against the simulated instruments
+    (a new Python process every time), which is dominated by the startup time. The best of repeat runs is compared with target.
+    """
+    argv = [sys.executable, BODE_PY, "100", "1000", "3", "--no_plots", "--simulate", "rc", "--output", os.devnull]
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(argv, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+
+    return {
+        "runs": repeat,
+        "min_s": min(times),
+        "mean_s": sum(times) / repeat,
+        "target_s": target,
+        "target_met": min(times) <= target,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the jds6600 protocol layer and the sweep of bode.py against simulated instruments (no hardware needed).")
+    parser.add_argument("--output", dest="OUTPUT", default="benchmark.json", help="The JSON file the results are written to.")
+    parser.add_argument("--latency", dest="LATENCY", default=0.001, type=float, help="The simulated latency in seconds of every command sent to the instruments.")
+    parser.add_argument("--iterations", dest="ITERATIONS", default=200, type=int, help="The number of repetitions for the single operation benchmarks.")
+    parser.add_argument("--points", dest="POINTS", default=[50, 500, 5000], type=int, nargs="+", help="The number of points of the benchmarked sweeps.")
+    parser.add_argument("--bode_args", dest="BODE_ARGS", default="", help="Additional options for bode.py in the sweep benchmarks (e.g. \"--phase --lockin\").")
+    parser.add_argument("--startup_target", dest="STARTUP_TARGET", default=0.5, type=float, help="The time in seconds a headless run of bode.py (including Python startup) may take at most.")
+    parser.add_argument("--no_sweeps", dest="SWEEPS", action="store_false", help="Only run the benchmarks of the single operations.")
+    args = parser.parse_args()
+
+    results = {
+        "info": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "latency_s": args.LATENCY,
+        },
+        "startup": {},
+        "codec": {},
+        "operations": {},
+        "sweeps": [],
+    }
+
+    print("Benchmarking startup")
+    results["startup"] = bench_startup(5, args.STARTUP_TARGET)
+    print("  headless run: %.3f s (target %.3f s: %s)" % (results["startup"]["min_s"], args.STARTUP_TARGET,
+                                                       "met" if results["startup"]["target_met"] else "MISSED"))
+
+    print("Benchmarking protocol overhead per transaction")
+    results["codec"] = bench_codec(args.ITERATIONS * 100)
+    for name, result in results["codec"].items():
+        print("  %-22s %8.2f us/op, %d reads  (legacy %8.2f us/op, %d reads: %.1fx)" % (
+            name, result["new"]["per_op_s"] * 1e6, result["new"]["reads_per_op"],
+            result["legacy"]["per_op_s"] * 1e6, result["legacy"]["reads_per_op"], result["speedup"]))
+
+    print("Benchmarking single operations (latency %g s)" % args.LATENCY)
+    results["operations"] = bench_protocol(args.LATENCY, args.ITERATIONS)
+    for name, result in results["operations"].items():
+        print("  %-22s %10.1f us/op  (python %8.1f us, io %8.1f us)" % (name, result["per_op_s"] * 1e6,
+                                                                        result["python_per_op_s"] * 1e6, result["io_per_op_s"] * 1e6))
+
+    if args.SWEEPS:
+        print("Benchmarking sweeps")
+        # The first run imports all modules used by bode.py, this should not be measured
+        bench_sweep(5, 0, shlex.split(args.BODE_ARGS))
+        for points in args.POINTS:
+            result = bench_sweep(points, args.LATENCY, shlex.split(args.BODE_ARGS))
+            results["sweeps"].append(result)
+            print("  %5d points: %8.1f points/s  (total %.2f s, python %.2f s, io %.2f s, wait %.2f s)" % (
+                points, result["points_per_s"], result["elapsed_s"], result["python_s"], result["io_s"], result["wait_s"]))
+
+    with open(args.OUTPUT, "w") as file:
+        json.dump(results, file, indent=2)
+    print("Results written to %s" % args.OUTPUT)
+
+
+if __name__ == "__main__":
+    main()
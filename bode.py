@@ -1,20 +1,22 @@
 # bode.py
-# Program to plot bode diagrams using a DS1054Z and a JDS6600
+# Program to plot bode diagrams using a DS1054Z and a JDS6600 (the measurement is done by bodesweep.BodeSweep)
 
 # Jan Böhmer (c) 2019
 # published under MIT license. See file "LICENSE" for full license text
 
 
-from jds6600 import *
+# Modules which take long to import (matplotlib, scipy, ds1054z) are only imported when they are needed,
+# so headless runs start fast
 
-import numpy as np
+import os
+import sys
 import time
-from ds1054z import DS1054Z
+import atexit
 import argparse
 
-import matplotlib.pyplot as plt
-
-import scipy.signal
+import sweeptrace
+import sweepwriter
+from bodesweep import BodeSweep, SweepPoint
 
 parser = argparse.ArgumentParser(description="This program plots Bode Diagrams of a DUT using an JDS6600 and Rigol DS1054Z")
 
@@ -22,29 +24,54 @@ parser.add_argument('MIN_FREQ', metavar='min', type=float, help="The minimum fre
 parser.add_argument('MAX_FREQ', metavar='max', type=float, help="The maximum frequency for which should be tested")
 parser.add_argument('COUNT', metavar='N', nargs="?", default=50, type=int, help='The number of frequencies for which should be probed')
 parser.add_argument("--awg_port", dest="AWG_PORT", default="COM3", help="The serial port where the JDS6600 is connected to")
+parser.add_argument("--awg_retries", dest="AWG_RETRIES", default=3, type=int, help="How often a command to the JDS6600 is repeated after a garbled or missing reply or an error of the serial port (which is then opened again). 0 to stop at the first error.")
 parser.add_argument("--ds_ip", default="auto", dest="OSC_IP", help="The IP address of the DS1054Z. Set to auto, to auto discover the oscilloscope via Zeroconf")
+parser.add_argument("--rediscover", dest="REDISCOVER", action="store_true", help="With --ds_ip auto, do not use the cached address of the oscilloscope found the last time, but discover it again.")
 parser.add_argument("--linear", dest="LINEAR", action="store_true", help="Set this flag to use a linear scale")
 parser.add_argument("--awg_voltage", dest="VOLTAGE", default=5, type=float, help="The amplitude of the signal used for the generator")
 parser.add_argument("--step_time", dest="TIMEOUT", default=0.00, type=float, help="The pause between to measurements in ms.")
+parser.add_argument("--settle", dest="SETTLE", action="store_true", help="Instead of waiting a fixed step time, repeat the measurement until two successive values agree (see --settle_tolerance). The settling time of each point is written to the output file.")
+parser.add_argument("--settle_cycles", dest="SETTLE_CYCLES", default=10, type=float, help="The number of periods of the new frequency, that are waited before (and between) measurements when --settle is used.")
+parser.add_argument("--settle_tolerance", dest="SETTLE_TOLERANCE", default=0.01, type=float, help="The relative difference two successive amplitude measurements may have, to be considered as settled.")
+parser.add_argument("--settle_timeout", dest="SETTLE_TIMEOUT", default=2, type=float, help="The maximum time in seconds that is waited for a point to settle. Two measurements are always compared, even if they take longer.")
 parser.add_argument("--phase", dest="PHASE", action="store_true", help="Set this flag if you want to plot the Phase diagram too")
 parser.add_argument("--no_smoothing", dest="SMOOTH", action="store_false", help="Set this to disable the smoothing of the data with a Savitzky–Golay filter")
 parser.add_argument("--use_manual_settings", dest="MANUAL_SETTINGS", action="store_true", help="When this option is set, the options on the oscilloscope for voltage and time base are not changed by this program.")
-parser.add_argument("--output", dest="file", type=argparse.FileType("w"), help="Write the measured data to the given CSV file.")
+parser.add_argument("--output", dest="OUTPUT", help="Write the measured data to the given file. Every point is written as soon as it is measured (in adaptive mode in the order of measurement). The format is selected by the extension: .npz, .h5/.hdf5 (needs h5py) and .parquet (needs pyarrow) also contain the timestamp and scope settings of every point and the settings of the sweep, all other extensions give a CSV file.")
+parser.add_argument("--checkpoint", dest="CHECKPOINT", help="Save the state of the sweep (options, frequencies and measured points) regularly to the given file, so an interrupted sweep can be continued with --resume.")
+parser.add_argument("--checkpoint_interval", dest="CHECKPOINT_INTERVAL", default=10, type=float, help="The time in seconds between two checkpoints. A checkpoint is also saved when the program ends.")
+parser.add_argument("--resume", dest="RESUME", help="Continue the sweep saved in the given checkpoint file: only the frequencies which were not measured yet are measured. The options of the interrupted sweep are used, options given in addition (like --awg_port) replace them.")
+parser.add_argument("--fsync", dest="FSYNC", action="store_true", help="Force every point of the output file to disk after it was written.")
 parser.add_argument("--no_plots", dest="PLOTS", action="store_false", help="When this option is set no plots are shown. Useful in combination with --output")
+parser.add_argument("--live", dest="LIVE", action="store_true", help="Show amplitude (and phase) in a window while the sweep is running, updated as each point arrives. The window is closed when the sweep is done.")
 parser.add_argument("--normalize", dest="NORMALIZE", action="store_true", help="Set this option if you dont want to get the absolute voltage levels on the output, but the value normalized on the input level.")
+parser.add_argument("--pipeline", dest="PIPELINE", action="store_true", help="Program the generator in a separate thread, so that it overlaps with the range settings of the oscilloscope for the next point.")
+parser.add_argument("--hw_sweep", dest="HW_SWEEP", action="store_true", help="Use the sweep function of the JDS6600 and capture the whole sweep with one long scope record, instead of measuring each frequency step by step.")
+parser.add_argument("--lockin", dest="LOCKIN", action="store_true", help="Read the raw samples of both channels and calculate amplitude and phase with a lock-in (single bin DFT) at the generator frequency, instead of using the measurements of the oscilloscope.")
+parser.add_argument("--adaptive", dest="ADAPTIVE", action="store_true", help="Start with a coarse frequency grid and add points only where amplitude or phase change fast (e.g. around resonances). N is then the maximum number of points.")
+parser.add_argument("--tolerance", dest="TOLERANCE", default=0.5, type=float, help="The allowed deviation of the amplitude in dB, before more points are measured in adaptive mode.")
+parser.add_argument("--phase_tolerance", dest="PHASE_TOLERANCE", default=5, type=float, help="The allowed deviation of the phase in degree, before more points are measured in adaptive mode.")
+parser.add_argument("--trace", dest="TRACE", help="Record the time of every phase of each point (generator commands, scope commands, waiting, measuring) and write it as Chrome trace JSON to the given file (can be viewed with ui.perfetto.dev). A summary is printed after the sweep.")
+parser.add_argument("--sweep_time", dest="SWEEP_TIME", default=10, type=float, help="The duration of the generator sweep in seconds, when --hw_sweep is used.")
+
+parser.add_argument("--simulate", dest="SIMULATE", choices=["rc", "rl", "lc"], help="Do not use real hardware, but a simulated JDS6600 and DS1054Z measuring the given DUT (RC low pass, RL high pass, LC parallel resonance circuit).")
+parser.add_argument("--sim_latency", dest="SIM_LATENCY", default=0.0, type=float, help="The latency in seconds of every command sent to the simulated instruments.")
+parser.add_argument("--sim_noise", dest="SIM_NOISE", default=0.001, type=float, help="The RMS voltage of the noise of the simulated oscilloscope.")
+
+# With --resume the options are taken from the checkpoint, additional options replace them
+resume_parser = argparse.ArgumentParser(add_help=False)
+resume_parser.add_argument("--resume", dest="RESUME")
+resume_args, argv = resume_parser.parse_known_args()
+
+checkpoint = None
+if resume_args.RESUME:
+    try:
+        checkpoint = sweepwriter.load_checkpoint(resume_args.RESUME)
+    except (OSError, ValueError) as e:
+        exit("Could not load checkpoint: %s" % e)
+    argv = checkpoint["argv"] + argv
 
-args = parser.parse_args()
-
-if args.OSC_IP == "auto":
-    import ds1054z.discovery
-    results = ds1054z.discovery.discover_devices()
-    if not results:
-        print("No Devices found! Try specifying the IP Address manually.")
-        exit()
-    OSC_IP = results[0].ip
-    print("Found Oscilloscope! Using IP Address " + OSC_IP)
-else:
-    OSC_IP = args.OSC_IP
+args = parser.parse_args(argv)
 
 DEFAULT_PORT = args.AWG_PORT
 MIN_FREQ = args.MIN_FREQ
@@ -61,117 +88,211 @@ if MIN_FREQ >= MAX_FREQ:
 if STEP_COUNT <= 0:
     exit("The step count has to be positive")
 
+if args.HW_SWEEP and not 0 < args.SWEEP_TIME <= 999.9:
+    exit("The sweep time has to be between 0 and 999.9 seconds")
+
+if args.HW_SWEEP and args.ADAPTIVE:
+    exit("--hw_sweep and --adaptive can not be used together")
+
+if args.HW_SWEEP and args.SETTLE:
+    exit("--hw_sweep and --settle can not be used together")
+
+if args.HW_SWEEP and args.CHECKPOINT:
+    exit("--hw_sweep and --checkpoint can not be used together")
+
+if args.HW_SWEEP and args.MANUAL_SETTINGS:
+    exit("--hw_sweep and --use_manual_settings can not be used together")
+
 TIMEOUT = args.TIMEOUT
 
+# Records the timing of the sweep (does nothing if --trace is not given)
+tracer = sweeptrace.Tracer(enabled=bool(args.TRACE))
+
 AWG_CHANNEL = 1
 AWG_VOLT = args.VOLTAGE
 
 print("Init AWG")
 
-awg = jds6600(DEFAULT_PORT)
-
-AWG_MAX_FREQ = awg.getinfo_devicetype()
-print("Maximum Generator Frequency: %d MHz"% AWG_MAX_FREQ)
-if MAX_FREQ > AWG_MAX_FREQ * 1e6:
-    exit("Your MAX_FREQ is higher than your AWG can achieve!")
+# The measurement options of the sweep, the connections are opened by BodeSweep
+options = dict(awg_channel=AWG_CHANNEL, voltage=AWG_VOLT, phase=args.PHASE, normalize=args.NORMALIZE, lockin=args.LOCKIN,
+               manual_settings=args.MANUAL_SETTINGS, step_time=TIMEOUT, settle=args.SETTLE, settle_cycles=args.SETTLE_CYCLES,
+               settle_tolerance=args.SETTLE_TOLERANCE, settle_timeout=args.SETTLE_TIMEOUT, pipeline=args.PIPELINE, tracer=tracer)
 
-# We use sine for sweep
-awg.setwaveform(AWG_CHANNEL, "sine")
+if args.SIMULATE:
+    bode = BodeSweep.simulate(args.SIMULATE, latency=args.SIM_LATENCY, noise=args.SIM_NOISE, awg_retries=args.AWG_RETRIES, **options)
+else:
+    try:
+        bode = BodeSweep.connect(DEFAULT_PORT, args.OSC_IP, rediscover=args.REDISCOVER, awg_retries=args.AWG_RETRIES, **options)
+    except RuntimeError as e:
+        print(e)
+        exit()
 
-# Init scope
-scope = DS1054Z(OSC_IP)
+print("Maximum Generator Frequency: %d MHz"% bode.awg_max_freq)
+if MAX_FREQ > bode.awg_max_freq * 1e6:
+    exit("Your MAX_FREQ is higher than your AWG can achieve!")
 
-# Set some options for the oscilloscope
+freqs = BodeSweep.frequencies(MIN_FREQ, MAX_FREQ, STEP_COUNT, args.LINEAR, args.ADAPTIVE)
+
+# Frequency, amplitude and phase of the measured points, only kept if they are plotted (so long sweeps with
+# --no_plots need constant memory)
+plot_points = list()
+
+# Write the points to the output file while measuring, so nothing is lost if the program is interrupted
+writer = None
+if args.OUTPUT:
+    metadata = {
+        "min_freq": MIN_FREQ,
+        "max_freq": MAX_FREQ,
+        "count": STEP_COUNT,
+        "linear": args.LINEAR,
+        "awg_channel": AWG_CHANNEL,
+        "awg_voltage": AWG_VOLT,
+        "ch1_scale": None if args.MANUAL_SETTINGS else args.VOLTAGE / 3,
+        "step_time": TIMEOUT,
+        "normalize": args.NORMALIZE,
+        "lockin": args.LOCKIN,
+        "settle": args.SETTLE,
+        "adaptive": args.ADAPTIVE,
+        "hw_sweep": args.HW_SWEEP,
+        "simulate": args.SIMULATE,
+    }
+    try:
+        writer = sweepwriter.open_writer(args.OUTPUT, phase=args.PHASE, settle=args.SETTLE, metadata=metadata, fsync=args.FSYNC)
+    except ImportError as e:
+        exit("The output format needs a module which is not installed: %s" % e)
+    atexit.register(writer.close)
+
+
+# The points measured since the last checkpoint, they are appended to the checkpoint file
+new_points = list()
+point_count = 0
+last_checkpoint = time.monotonic()
+
+# The points of the interrupted sweep (with --resume), they are not measured again
+restored_points = list()
+if checkpoint:
+    restored_points = [SweepPoint(**point) for point in checkpoint["points"]]
+    print("Resuming sweep: %d points were already measured" % len(restored_points))
+# They are already in the new checkpoint file
+restored_freqs = {point.freq for point in restored_points}
+
+
+def save_checkpoint(complete=False):
+    """Appends the points measured since the last checkpoint and the state of the sweep to the checkpoint file."""
+    global last_checkpoint
+    sweepwriter.append_checkpoint(args.CHECKPOINT, new_points, {
+        "complete": complete,
+        "scope": {"ch2_scale": bode.current_scale, "timebase": bode.current_timebase},
+    })
+    new_points.clear()
+    last_checkpoint = time.monotonic()
+
+
+def save_final_checkpoint():
+    """Saves the checkpoint when the program ends (also if the sweep was interrupted)."""
+    save_checkpoint(sweep_done)
+    if not sweep_done:
+        print("Sweep was interrupted after %d points, continue it with --resume %s" % (point_count, args.CHECKPOINT))
+
+
+sweep_done = False
+if args.CHECKPOINT:
+    # The settings are only written at the start, together with the restored points of a resumed sweep
+    # (so they are not lost if the program is killed before the next checkpoint)
+    sweepwriter.save_checkpoint(args.CHECKPOINT, {
+        "argv": argv,
+        "complete": False,
+        "freqs": [float(freq) for freq in freqs],
+        "awg": {"channel": AWG_CHANNEL, "waveform": "sine", "amplitude": AWG_VOLT},
+        "scope": {"ch2_scale": bode.current_scale, "timebase": bode.current_timebase},
+        "points": [point._asdict() for point in restored_points],
+    })
+    atexit.register(save_final_checkpoint)
+
+
+def store_point(point):
+    """Stores a measured point for the plots, writes it to the output file and (from time to time) to the checkpoint."""
+    global point_count
+    point_count += 1
+    if args.PLOTS:
+        plot_points.append((point.freq, point.volt, point.phase))
+    if args.CHECKPOINT and point.freq not in restored_freqs:
+        new_points.append(point._asdict())
+
+    if writer:
+        writer.write_point(**point._asdict())
+    if args.CHECKPOINT and time.monotonic() - last_checkpoint >= args.CHECKPOINT_INTERVAL:
+        save_checkpoint()
+
+
+# Without a display (e.g. over SSH) the plots are saved as PNG files instead of being shown
+HEADLESS = sys.platform.startswith("linux") and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY") or os.environ.get("MPLBACKEND"))
+
+# The live plot is drawn by its own process, so it does not slow down the sweep
+live = None
+if args.LIVE and HEADLESS:
+    print("No display found, --live is ignored")
+elif args.LIVE:
+    from liveplot import LivePlot
+    live = LivePlot(MIN_FREQ, MAX_FREQ, linear=args.LINEAR, phase=args.PHASE)
+    atexit.register(live.close)
+
+for point in bode.sweep(MIN_FREQ, MAX_FREQ, STEP_COUNT, linear=args.LINEAR, adaptive=args.ADAPTIVE, tolerance=args.TOLERANCE,
+                        phase_tolerance=args.PHASE_TOLERANCE, hw_sweep=args.HW_SWEEP, sweep_time=args.SWEEP_TIME,
+                        restored=restored_points):
+    if not args.HW_SWEEP:
+        print(point.freq)
+    store_point(point)
+    if live:
+        live.add(point.freq, point.volt, point.phase)
+
+sweep_done = True
+
+retries, reconnects = bode.awg.getretries()
+if retries:
+    print("%d commands to the AWG were repeated after errors (%d reconnects)" % (retries, reconnects))
+
+if live:
+    live.close()
+
+if args.TRACE:
+    tracer.export(args.TRACE)
+    print(tracer.format_summary())
+
+if writer:
+    writer.close()
 
-if not args.MANUAL_SETTINGS:
-    # Center vertically
-    scope.set_channel_offset(1, 0)
-    scope.set_channel_offset(2, 0)
+# Plot graphics
 
-    # Set the sensitivity according to the selected voltage
-    scope.set_channel_scale(1, args.VOLTAGE / 3, use_closest_match=True)
-    # Be a bit more pessimistic for the default voltage, because we run into problems if it is too confident
-    scope.set_channel_scale(2, args.VOLTAGE / 2, use_closest_match=True) 
+if not args.PLOTS:
+    exit()
 
-freqs = np.linspace(MIN_FREQ, MAX_FREQ, num=STEP_COUNT)
+# Sort the results by frequency (in adaptive mode they are stored in the order of measurement)
+plot_points.sort(key=lambda point: point[0])
+freqs = [point[0] for point in plot_points]
+volts = [point[1] for point in plot_points]
+phases = [point[2] for point in plot_points]
 
-if not args.LINEAR:
-    freqs = np.logspace(np.log10(MIN_FREQ), np.log10(MAX_FREQ), num=STEP_COUNT)
-else:
-    freqs = np.linspace(MIN_FREQ, MAX_FREQ, num=STEP_COUNT)
+import matplotlib
 
-# Set amplitude
-awg.setamplitude(AWG_CHANNEL, AWG_VOLT)
+if HEADLESS:
+    matplotlib.use("Agg")
 
-volts = list()
-phases = list()
+import matplotlib.pyplot as plt
 
-# We have to wait a bit before we measure the first value
-awg.setfrequency(AWG_CHANNEL, float(freqs[0]))
-time.sleep(0.05)
+if args.SMOOTH:
+    import scipy.signal
 
-for freq in freqs:
-    awg.setfrequency(AWG_CHANNEL, float(freq))
-    time.sleep(TIMEOUT)
 
-    if not args.NORMALIZE:
-        volt = scope.get_channel_measurement(2, 'vpp')
-        volts.append(volt)
-    else:
-        volt0 = scope.get_channel_measurement(1, 'vpp')
-        volt = scope.get_channel_measurement(2, 'vpp')
-        volts.append(volt/volt0)
-
-    # Use a better timebase
-    if not args.MANUAL_SETTINGS:
-        # Display one period in 3 divs
-        period = (1/freq) / 3
-        scope.timebase_scale = period
-
-        # Use better voltage scale for next time
-        if volt:
-            scope.set_channel_scale(2, volt / 2, use_closest_match=True)
-        else:
-            scope.set_channel_scale(2, AWG_VOLT / 2, use_closest_match=True)
-
-    # Measure phase
-    if args.PHASE:
-        phase = scope.get_channel_measurement('CHAN1, CHAN2', 'rphase')
-        if phase:
-            phase = -phase
-        phases.append(phase)
-
-    print(freq)
-
-# Write data to file if needed
-if args.file:
-
-    if args.PHASE:
-        args.file.write("Frequency in Hz; Amplitude in V; Phase in Degree\n")
+def show_plot(name):
+    """Shows the current plot, or saves it to name.png if there is no display."""
+    if HEADLESS:
+        plt.savefig(name + ".png")
+        plt.close()
+        print("No display found, plot saved to %s.png" % name)
     else:
-        args.file.write("Frequency in Hz; Amplitude in V\n")
-
-    for n in range(0, len(freqs)):
-        if volts[n]:
-            volt = volts[n]
-        else:
-            volt = float("nan")
-        
-        if args.PHASE:
-            if phases[n]:
-                phase = phases[n]
-            else:
-                phase = phases[n]
-            args.file.write("%f;%f;%f \n"%(freqs[n], volt, phase))
-        else:
-            args.file.write("%f;%f \n"%(freqs[n], volt))
-      
-    args.file.close()
+        plt.show()
 
-# Plot graphics
-
-if not args.PLOTS:
-    exit()
 
 plt.plot(freqs, volts, label="Measured data")
 if args.SMOOTH:
@@ -181,7 +302,7 @@ if args.SMOOTH:
     except:
         print("Error during smoothing amplitude data")
 
-plt.title("Amplitude diagram (N=%d)"%STEP_COUNT)
+plt.title("Amplitude diagram (N=%d)"%len(freqs))
 plt.xlabel("Frequency [Hz]")
 plt.ylabel("Voltage Peak-Peak [V]")
 plt.legend()
@@ -190,11 +311,11 @@ plt.legend()
 if not args.LINEAR:
     plt.xscale("log")
 
-plt.show()
+show_plot("amplitude")
 
 if args.PHASE:
     plt.plot(freqs, phases)
-    plt.title("Phase diagram (N=%d)"%STEP_COUNT)
+    plt.title("Phase diagram (N=%d)"%len(freqs))
     plt.ylabel("Phase [°]")
     plt.xlabel("Frequency [Hz]")
 
@@ -210,4 +331,4 @@ if args.PHASE:
     if not args.LINEAR:
         plt.xscale("log")
 
-    plt.show()
\ No newline at end of file
+    show_plot("phase")
\ No newline at end of file
@@ -0,0 +1,229 @@
+# bodeanalysis.py
+# Signal processing functions used by bode.py
+
+# Jan Böhmer (c) 2019
+# published under MIT license. See file "LICENSE" for full license text
+
+import numpy as np
+
+
+def sweep_frequency(t, f_start, f_end, sweep_time, logarithmic):
+    """
+    Returns the frequency of a generator sweep at the time t (in seconds after the start of the sweep).
+    """
+    x = np.clip(np.asarray(t, dtype=float) / sweep_time, 0, 1)
+    if logarithmic:
+        return f_start * (f_end / f_start) ** x
+    return f_start + (f_end - f_start) * x
+
+
+def sweep_time_of(freq, f_start, f_end, sweep_time, logarithmic):
+    """
+    Returns the time (in seconds after the start of the sweep) at which the generator sweep reaches freq.
+    This is the inverse of sweep_frequency().
+    """
+    freq = np.asarray(freq, dtype=float)
+    if logarithmic:
+        return sweep_time * np.log(freq / f_start) / np.log(f_end / f_start)
+    return sweep_time * (freq - f_start) / (f_end - f_start)
+
+
+def rising_zero_crossings(t, signal):
+    """
+    Returns the (linear interpolated) times, at which the signal crosses its mean value with a rising edge.
+    """
+    signal = np.asarray(signal, dtype=float)
+    signal = signal - np.nanmean(signal)
+    idx = np.nonzero((signal[:-1] < 0) & (signal[1:] >= 0))[0]
+    frac = -signal[idx] / (signal[idx + 1] - signal[idx])
+    return t[idx] + frac * (t[idx + 1] - t[idx])
+
+
+def find_sweep_start(t, reference, f_start, f_end, sweep_time, logarithmic):
+    """
+    Estimates the time in the record t at which the generator sweep started.
+
+    The instantaneous frequency of the reference signal (the generator output) is determined
+    from the distance of its zero crossings. Every estimate is mapped back with the known
+    sweep law to a start time, the median of them is returned (None if the record contains no sweep).
+    """
+    crossings = rising_zero_crossings(t, reference)
+    if len(crossings) < 3:
+        return None
+
+    periods = np.diff(crossings)
+    mid = (crossings[1:] + crossings[:-1]) / 2
+    freqs = 1 / periods
+
+    # Ignore everything which can not belong to the sweep (noise, glitches)
+    valid = (freqs >= min(f_start, f_end)) & (freqs <= max(f_start, f_end))
+    if not np.any(valid):
+        return None
+
+    return float(np.median(mid[valid] - sweep_time_of(freqs[valid], f_start, f_end, sweep_time, logarithmic)))
+
+
+def sweep_phase(t, f_start, f_end, sweep_time, logarithmic):
+    """
+    Returns the phase (in radian) of a generator sweep at the time t (in seconds after the start of the sweep).
+    """
+    t = np.asarray(t, dtype=float)
+    if logarithmic:
+        k = np.log(f_end / f_start) / sweep_time
+        return 2 * np.pi * f_start * np.expm1(k * t) / k
+    return 2 * np.pi * (f_start * t + (f_end - f_start) * t ** 2 / (2 * sweep_time))
+
+
+def reconstruct_sweep(t, ch1, ch2, freqs, f_start, f_end, sweep_time, logarithmic, cycles=10):
+    """
+    Reconstructs amplitude and phase from a record of a generator sweep.
+
+    t, ch1 and ch2 are the time values and samples of the scope record, ch1 is the DUT input (generator output),
+    ch2 the DUT output. For every frequency in freqs a window of the given number of cycles around the
+    moment the sweep reached this frequency is evaluated with a lock-in, whose reference follows the sweep law.
+
+    Returns three arrays (peak-peak voltage of ch1, peak-peak voltage of ch2, phase of ch2 relative to ch1 in degree).
+    Frequencies which are not (at least half a window) contained in the record or whose signal is too small are NaN.
+    """
+    t = np.asarray(t, dtype=float)
+    ch1 = np.asarray(ch1, dtype=float)
+    ch2 = np.asarray(ch2, dtype=float)
+    freqs = np.asarray(freqs, dtype=float)
+
+    volts1 = np.full(len(freqs), np.nan)
+    volts2 = np.full(len(freqs), np.nan)
+    phases = np.full(len(freqs), np.nan)
+
+    t0 = find_sweep_start(t, ch1, f_start, f_end, sweep_time, logarithmic)
+    if t0 is None:
+        return volts1, volts2, phases
+
+    # The windows are limited to the sweep, so at its ends only half a window is used
+    centers = t0 + sweep_time_of(freqs, f_start, f_end, sweep_time, logarithmic)
+    half = cycles / freqs / 2
+    starts = np.searchsorted(t, np.maximum(centers - half, t0))
+    stops = np.searchsorted(t, np.minimum(centers + half, t0 + sweep_time))
+
+    for n in range(len(freqs)):
+        # Skip windows which are not at least half inside the record
+        if stops[n] - starts[n] < 4 or t[stops[n] - 1] - t[starts[n]] < half[n] * 0.9:
+            continue
+
+        window = slice(starts[n], stops[n])
+        reference = np.exp(-1j * sweep_phase(t[window] - t0, f_start, f_end, sweep_time, logarithmic))
+        weights = np.hanning(stops[n] - starts[n])
+        z1, z2 = (4 * np.sum(weights * (x[window] - np.mean(x[window])) * reference) / np.sum(weights) for x in (ch1, ch2))
+
+        # A signal below the resolution of the ADC (only one quantization level) can not be measured
+        if z1 == 0 or z2 == 0:
+            continue
+
+        volts1[n] = abs(z1)
+        volts2[n] = abs(z2)
+        phases[n] = np.degrees(np.angle(z2 / z1))
+
+    return volts1, volts2, phases
+
+
+def refine_frequencies(freqs, volts, phases=None, tolerance=0.5, phase_tolerance=5.0, min_spacing=0.0, logarithmic=True, limit=None):
+    """
+    Determines where additional frequencies should be measured in an adaptive sweep.
+
+    An interval between two measured frequencies is refined, when one of its points deviates more than tolerance (in dB)
+    or phase_tolerance (in degree) from the straight line through its neighbours (curvature), or when the
+    amplitude or phase changes more than ten times the tolerance over the interval (slope).
+    Intervals smaller than 2 * min_spacing (in decades for logarithmic sweeps, in Hz for linear sweeps) are not divided.
+    Invalid values (None or NaN) are ignored.
+
+    Returns the sorted array of new frequencies (at most limit, the most important ones are selected),
+    which are placed in the middle of the intervals.
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    if len(freqs) < 3:
+        return np.array([])
+
+    order = np.argsort(freqs)
+    freqs = freqs[order]
+    x = np.log10(freqs) if logarithmic else freqs
+
+    curves = [(20 * np.log10(np.abs(np.asarray(volts, dtype=float)[order])), tolerance)]
+    if phases is not None:
+        curves.append((np.asarray(phases, dtype=float)[order], phase_tolerance))
+
+    # Score for every interval: > 1 means it has to be refined
+    score = np.zeros(len(freqs) - 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for y, tol in curves:
+            # Deviation of every inner point from the line through its neighbours
+            interp = y[:-2] + (y[2:] - y[:-2]) * (x[1:-1] - x[:-2]) / (x[2:] - x[:-2])
+            curvature = np.nan_to_num(np.abs(y[1:-1] - interp) / tol)
+            score[:-1] = np.maximum(score[:-1], curvature)
+            score[1:] = np.maximum(score[1:], curvature)
+
+            slope = np.nan_to_num(np.abs(np.diff(y)) / (10 * tol))
+            score = np.maximum(score, slope)
+
+    idx = np.nonzero((score > 1) & (np.diff(x) >= 2 * min_spacing))[0]
+    idx = idx[np.argsort(-score[idx], kind="stable")]
+    if limit is not None:
+        idx = idx[:max(limit, 0)]
+
+    new_x = (x[idx] + x[idx + 1]) / 2
+    return np.sort(10 ** new_x if logarithmic else new_x)
+
+
+def lockin(t, samples, freqs):
+    """
+    Determines amplitude and phase of the sine with the known frequency in a record, using a single bin DFT (lock-in).
+
+    samples can be a single record (1d) or a batch of records (2d, one record per row), which are processed
+    in one vectorized pass. t contains the time values of the samples (either one row for all records or one row per record),
+    freqs the excitation frequency (one per record). The mean is removed and a Hann window is applied,
+    NaN samples (e.g. parts outside of the screen) are ignored.
+
+    Returns a complex value per record: its absolute value is the peak-peak voltage of the sine,
+    its angle the phase (in radian) relative to t=0.
+    """
+    samples = np.asarray(samples, dtype=float)
+    single = samples.ndim == 1
+    samples = np.atleast_2d(samples)
+    t = np.atleast_2d(np.asarray(t, dtype=float))
+    freqs = np.atleast_1d(np.asarray(freqs, dtype=float))[:, np.newaxis]
+
+    valid = np.isfinite(samples)
+    x = np.where(valid, samples, 0)
+    mean = np.sum(x, axis=1, keepdims=True) / np.sum(valid, axis=1, keepdims=True)
+
+    window = np.hanning(samples.shape[1]) * valid
+    z = np.sum(window * (x - mean) * np.exp(-2j * np.pi * freqs * t), axis=1) / np.sum(window, axis=1)
+
+    # z is half the amplitude, the peak-peak voltage is two times the amplitude
+    z = 4 * z
+    return z[0] if single else z
+
+
+def predict_amplitude(freqs, volts, freq, max_slope=3):
+    """
+    Predicts the amplitude at the frequency freq from already measured points.
+
+    The magnitude curve is extrapolated linearly (in log-log scale) through the two measured points nearest to freq.
+    The slope is limited to max_slope (3 means 60 dB per decade). Invalid values (None, NaN, <= 0) are ignored.
+    Returns None when there are no valid points.
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    volts = np.asarray(volts, dtype=float)
+    with np.errstate(invalid="ignore"):
+        valid = np.isfinite(volts) & (volts > 0) & (freqs > 0)
+    if not np.any(valid):
+        return None
+
+    x = np.log10(freqs[valid])
+    y = np.log10(volts[valid])
+    nearest = np.argsort(np.abs(x - np.log10(freq)), kind="stable")[:2]
+
+    if len(nearest) < 2 or x[nearest[0]] == x[nearest[1]]:
+        return float(10 ** y[nearest[0]])
+
+    (x1, x2), (y1, y2) = x[nearest], y[nearest]
+    slope = np.clip((y2 - y1) / (x2 - x1), -max_slope, max_slope)
+    return float(10 ** (y1 + slope * (np.log10(freq) - x1)))
@@ -0,0 +1,515 @@
+# bodesweep.py
+# Measures bode diagrams using a DS1054Z and a JDS6600, usable as a library (bode.py is the command line interface)
+
+# Jan Böhmer (c) 2019
+# published under MIT license. See file "LICENSE" for full license text
+
+import collections
+import time
+
+import numpy as np
+
+import bodeanalysis
+import scopediscovery
+import sweeptrace
+from jds6600 import jds6600
+
+# A measured point: the amplitude volt (normalized if needed, None if it could not be measured), the phase in degree
+# (None if not measured), the time it took to settle, the CH2 scale and timebase of the scope and the time of the measurement
+SweepPoint = collections.namedtuple("SweepPoint", ["freq", "volt", "phase", "settle_time", "scale", "timebase", "timestamp"])
+
+# The result of BodeSweep.measure(): numpy arrays sorted by frequency, values which were not measured are NaN
+SweepResult = collections.namedtuple("SweepResult", ["freqs", "volts", "phases", "settle_times"])
+
+
+class BodeSweep:
+    """
+    Measures the bode diagram of a DUT: the generator output is connected to CH1 of the scope and to the DUT input,
+    CH2 of the scope to the DUT output.
+
+    The object owns the connections to the generator (a jds6600 object) and the scope (a ds1054z.DS1054Z like object),
+    so several DUTs can be measured one after the other without connecting again. Use connect() to open the connections
+    to real instruments or simulate() for simulated ones. sweep() yields the points while they are measured,
+    measure() returns the whole result as numpy arrays.
+
+    The options correspond to the options of bode.py with the same name. Messages for the user (like warnings)
+    are passed to log (None to suppress them).
+    """
+
+    def __init__(self, awg, scope, awg_channel=1, voltage=5, phase=False, normalize=False, lockin=False,
+                 manual_settings=False, step_time=0, settle=False, settle_cycles=10, settle_tolerance=0.01,
+                 settle_timeout=2, pipeline=False, tracer=None, log=print):
+        self.awg = awg
+        self.scope = scope
+        self.awg_channel = awg_channel
+        self.voltage = voltage
+        self.phase = phase
+        self.normalize = normalize
+        self.lockin = lockin
+        self.manual_settings = manual_settings
+        self.step_time = step_time
+        self.settle = settle
+        self.settle_cycles = settle_cycles
+        self.settle_tolerance = settle_tolerance
+        self.settle_timeout = settle_timeout
+        self.log = log
+
+        # Generators from a jds6600pool are not closed by close()
+        self.close_awg = True
+
+        # Records the timing of the sweeps (does nothing if no enabled tracer is given)
+        self.tracer = tracer or sweeptrace.Tracer(enabled=False)
+        if self.tracer.enabled:
+            self.awg.settracer(self.tracer)
+
+        # The current range settings of the scope, so commands are only sent when something changes
+        self.current_scale = None
+        self.current_timebase = None
+
+        # All valid amplitudes measured on CH2 in the current sweep, used to predict the amplitude of the next point
+        self.range_freqs = list()
+        self.range_volts = list()
+
+        # With pipeline all generator commands of the sweep run in this worker, while the caller talks to the scope
+        self.awg_worker = None
+        if pipeline:
+            import concurrent.futures
+            self.awg_worker = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        self._setup()
+
+    @classmethod
+    def connect(cls, awg_port, scope_ip="auto", rediscover=False, awg_pool=None, awg_retries=3, **kwargs):
+        """
+        Connects to the generator on the serial port awg_port and the scope with the IP address scope_ip
+        ("auto" to find it in the network, see scopediscovery.find_scope()). kwargs are the options of the constructor.
+        Failed commands to the generator are repeated up to awg_retries times (see jds6600), reconnecting if needed.
+        If a jds6600pool is given as awg_pool, the generator is taken from it and stays open when the BodeSweep is closed
+        (awg_retries then also applies to later users of the generator).
+        """
+        log = kwargs.get("log", print)
+        if scope_ip == "auto":
+            # The oscilloscope found the last time is used, if it still answers
+            scope_ip, idn = scopediscovery.find_scope(use_cache=not rediscover)
+            if not scope_ip:
+                raise RuntimeError("No Devices found! Try specifying the IP Address manually.")
+            if log:
+                log("Found Oscilloscope! Using IP Address " + scope_ip)
+
+        from ds1054z import DS1054Z
+
+        # Use the register cache, so setfrequency() does not need to read the mode for every point
+        if awg_pool:
+            awg = awg_pool.get(awg_port)
+            awg.cache_enable(True)
+            awg.setretries(awg_retries)
+        else:
+            awg = jds6600(awg_port, cache=True, retries=awg_retries)
+        scope = DS1054Z(scope_ip)
+        bode = cls(awg, scope, **kwargs)
+        bode.close_awg = not awg_pool
+        return bode
+
+    @classmethod
+    def simulate(cls, dut="rc", latency=0.0, noise=0.001, awg_retries=3, **kwargs):
+        """
+        Uses a simulated generator and scope measuring the DUT dut (see simulator.DUTS), with the given latency
+        of every command and RMS noise voltage of the scope. awg_retries and kwargs are the same as for connect().
+        """
+        import simulator
+        awg_port = simulator.SimulatedJDS6600(latency=latency)
+        scope = simulator.SimulatedDS1054Z(awg_port, dut, latency=latency, noise=noise)
+        return cls(jds6600(awg_port, cache=True, retries=awg_retries), scope, **kwargs)
+
+    def close(self):
+        """Closes the connections to the instruments."""
+        if self.awg_worker:
+            self.awg_worker.shutdown()
+        if self.close_awg:
+            self.awg.close()
+        self.scope.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _setup(self):
+        """Checks the generator and sets up the scope."""
+        # Read the current generator settings (this also fills the register cache)
+        state = self.awg.getstate()
+        if not (state.channel1 if self.awg_channel == 1 else state.channel2).enabled and self.log:
+            self.log("Warning: Output of AWG channel %d is disabled!" % self.awg_channel)
+
+        # The frequency can not be set while the generator is sweeping
+        if state.mode[1] == "SWEEP_CH%d" % self.awg_channel:
+            self.awg.setmode("WAVE_CH%d" % self.awg_channel)
+
+        # The maximum frequency of the generator in MHz
+        self.awg_max_freq = self.awg.getinfo_devicetype()
+
+        if not self.manual_settings:
+            # Center vertically
+            self.scope.set_channel_offset(1, 0)
+            self.scope.set_channel_offset(2, 0)
+
+            # Set the sensitivity according to the selected voltage
+            self.scope.set_channel_scale(1, self.voltage / 3, use_closest_match=True)
+
+        # The possible vertical scales of CH2, so we can select them without asking the scope every time
+        self.ch2_scales = [scale * self.scope.get_probe_ratio(2) for scale in self.scope.possible_channel_scale_values] if not self.manual_settings else []
+
+        if not self.manual_settings:
+            # Be a bit more pessimistic for the default voltage, because we run into problems if it is too confident
+            self.set_scale(self.voltage)
+
+    def set_scale(self, volt):
+        """
+        Sets the vertical scale of CH2, so that a signal with the peak-peak voltage volt spans 2 divs.
+        Returns True if the scale was changed.
+        """
+        scale = min(self.ch2_scales, key=lambda x: abs(x - volt / 2))
+        if scale == self.current_scale:
+            return False
+        with self.tracer.span("set_channel_scale", "scope"):
+            self.scope.set_channel_scale(2, scale)
+        self.current_scale = scale
+        return True
+
+    def set_timebase(self, freq):
+        """
+        Sets the timebase, so that one period of freq is displayed in 3 divs.
+        """
+        timebase = min(self.scope.possible_timebase_scale_values, key=lambda x: abs(x - (1/freq) / 3))
+        if timebase != self.current_timebase:
+            with self.tracer.span("timebase_scale", "scope"):
+                self.scope.timebase_scale = timebase
+            self.current_timebase = timebase
+
+    @staticmethod
+    def frequencies(min_freq, max_freq, count, linear=False, adaptive=False):
+        """Returns the frequencies of a sweep (in adaptive mode the coarse grid it starts with)."""
+        # In adaptive mode we start with a coarse grid (which stays within the budget of count points)
+        grid_count = min(count, max(count // 4, 5)) if adaptive else count
+        if linear:
+            return np.linspace(min_freq, max_freq, num=grid_count)
+        return np.logspace(np.log10(min_freq), np.log10(max_freq), num=grid_count)
+
+    def sweep(self, min_freq, max_freq, count=50, linear=False, adaptive=False, tolerance=0.5, phase_tolerance=5,
+              hw_sweep=False, sweep_time=10, restored=None):
+        """
+        Measures count frequencies from min_freq to max_freq (logarithmic or linear spaced) and yields a SweepPoint
+        for every frequency as soon as it is measured.
+
+        In adaptive mode the sweep starts with a coarse grid, and adds points where amplitude or phase are not smooth
+        (see bodeanalysis.refine_frequencies()), count is then the maximum number of points. The points are yielded in the
+        order of measurement. With hw_sweep, the sweep function of the generator is used (in sweep_time seconds)
+        and all points are yielded at the end.
+        restored are the points of an interrupted sweep with the same settings, they are yielded without being measured again.
+        """
+        if min_freq <= 0 or max_freq <= 0:
+            raise ValueError("Frequencies has to be greater 0!")
+        if min_freq >= max_freq:
+            raise ValueError("max_freq has to be greater then min frequency")
+        if count <= 0:
+            raise ValueError("The step count has to be positive")
+        if max_freq > self.awg_max_freq * 1e6:
+            raise ValueError("max_freq is higher than the AWG can achieve")
+        if hw_sweep and not 0 < sweep_time <= 999.9:
+            raise ValueError("The sweep time has to be between 0 and 999.9 seconds")
+        if hw_sweep and (adaptive or self.settle or restored):
+            raise ValueError("hw_sweep can not be used in adaptive mode, with settle or to resume a sweep")
+        if hw_sweep and self.manual_settings:
+            # the whole sweep has to fit in one scope record, so the timebase has to be set
+            raise ValueError("hw_sweep can not be used with manual_settings")
+
+        freqs = self.frequencies(min_freq, max_freq, count, linear, adaptive)
+        restored = {point.freq: point for point in restored or []}
+
+        # The amplitudes of the last sweep are not valid for this one
+        self.range_freqs = list()
+        self.range_volts = list()
+
+        if restored and not self.manual_settings:
+            # Continue with the range settings of the scope of the interrupted sweep
+            last = max(restored.values(), key=lambda point: point.timestamp)
+            if last.scale and last.scale != self.current_scale:
+                self.scope.set_channel_scale(2, last.scale)
+                self.current_scale = last.scale
+            if not self.normalize:
+                self.range_freqs = [point.freq for point in restored.values() if point.volt]
+                self.range_volts = [point.volt for point in restored.values() if point.volt]
+
+        # Setup the generator in one go: we use sine for sweep, with the given amplitude
+        with self.awg.transaction():
+            self.awg.setwaveform(self.awg_channel, "sine")
+            self.awg.setamplitude(self.awg_channel, self.voltage)
+            self.awg.setfrequency(self.awg_channel, float(freqs[0]))
+
+        # We have to wait a bit before we measure the first value (not needed if we wait for every point to settle)
+        if not self.settle:
+            time.sleep(0.05)
+
+        if hw_sweep:
+            yield from self._hw_sweep(freqs, min_freq, max_freq, sweep_time, linear)
+            return
+
+        if not adaptive:
+            for freq in freqs:
+                yield self._point(freq, restored)
+            return
+
+        # Start with a coarse grid and refine it, where the curves are not smooth
+        if not linear:
+            # Dont refine further than a quarter of the step size of a normal sweep
+            min_spacing = (np.log10(max_freq) - np.log10(min_freq)) / count / 4
+        else:
+            min_spacing = (max_freq - min_freq) / count / 4
+
+        freqs = list(freqs)
+        volts = list()
+        phases = list()
+        for freq in freqs:
+            point = self._point(freq, restored)
+            volts.append(point.volt)
+            phases.append(point.phase)
+            yield point
+
+        while len(freqs) < count:
+            new_freqs = bodeanalysis.refine_frequencies(freqs, volts, phases if self.phase else None,
+                                                        tolerance=tolerance, phase_tolerance=phase_tolerance,
+                                                        min_spacing=min_spacing, logarithmic=not linear,
+                                                        limit=count - len(freqs))
+            if len(new_freqs) == 0:
+                break
+
+            for freq in new_freqs:
+                point = self._point(freq, restored)
+                freqs.append(freq)
+                volts.append(point.volt)
+                phases.append(point.phase)
+                yield point
+
+    def measure(self, *args, **kwargs):
+        """
+        Runs a sweep (with the same arguments as sweep()) and returns the result as SweepResult of numpy arrays,
+        sorted by frequency.
+        """
+        points = sorted(self.sweep(*args, **kwargs), key=lambda point: point.freq)
+
+        def column(values):
+            return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+        return SweepResult(column(point.freq for point in points), column(point.volt for point in points),
+                           column(point.phase for point in points), column(point.settle_time for point in points))
+
+    def _point(self, freq, restored):
+        """Measures the point at freq, points of an interrupted sweep are not measured again."""
+        if freq in restored:
+            return restored[freq]
+        result, phase, settle_time = self.measure_point(freq)
+        return SweepPoint(float(freq), result, phase, settle_time, self.current_scale, self.current_timebase, time.time())
+
+    def read_measurement(self, freq):
+        """
+        Measures the DUT at the current generator frequency freq.
+        Returns the amplitude (normalized if needed), the peak-peak voltage of the DUT output and the phase (None if not measured).
+        """
+        with self.tracer.span("measure", "scope"):
+            return self._read_measurement(freq)
+
+    def _read_measurement(self, freq):
+        if self.lockin:
+            # Read the samples of the screen of both channels and evaluate them at the generator frequency
+            samples = [self.scope.get_waveform_samples(channel) for channel in (1, 2)]
+            preamble = self.scope.waveform_preamble_dict
+            t = preamble['xorig'] + preamble['xinc'] * np.arange(len(samples[0]))
+            z0, z = bodeanalysis.lockin(t, samples, [freq, freq])
+            volt0 = abs(z0)
+            volt = abs(z)
+            if not self.normalize:
+                result = volt
+            else:
+                result = volt/volt0 if volt0 else None
+        elif not self.normalize:
+            volt = self.scope.get_channel_measurement(2, 'vpp')
+            result = volt
+        else:
+            volt0 = self.scope.get_channel_measurement(1, 'vpp')
+            volt = self.scope.get_channel_measurement(2, 'vpp')
+            # A channel without a valid measurement gives no result (if it is CH2, the range is changed and it is retried)
+            result = volt/volt0 if volt is not None and volt0 else None
+
+        # Measure phase
+        phase = None
+        if self.phase and self.lockin:
+            phase = float(np.degrees(np.angle(z / z0)))
+        elif self.phase:
+            phase = self.scope.get_channel_measurement('CHAN1, CHAN2', 'rphase')
+            if phase:
+                phase = -phase
+
+        return result, volt, phase
+
+    def wait_and_read(self, freq, start):
+        """
+        Waits until the DUT has settled after a change (started at the time start) and measures it.
+        With settle, at least two measurements are compared, also when settle_timeout is already over
+        after the first one (at low frequencies the settle cycles can take longer than the timeout).
+        Returns the same values as read_measurement().
+        """
+        if self.settle:
+            # Wait some periods of the new frequency, then measure until two successive values agree
+            with self.tracer.span("sleep"):
+                time.sleep(max(self.step_time, self.settle_cycles / freq))
+            result, volt, phase = self.read_measurement(freq)
+            while True:
+                # Give the scope time to acquire new data
+                with self.tracer.span("sleep"):
+                    time.sleep(self.settle_cycles / freq)
+                last = result
+                result, volt, phase = self.read_measurement(freq)
+                if result is not None and last is not None and abs(result - last) <= self.settle_tolerance * abs(result):
+                    break
+                if time.monotonic() - start >= self.settle_timeout:
+                    break
+        else:
+            with self.tracer.span("sleep"):
+                time.sleep(self.step_time)
+            result, volt, phase = self.read_measurement(freq)
+
+        return result, volt, phase
+
+    def set_frequency(self, freq):
+        """Sets the generator to the frequency freq."""
+        with self.tracer.span("setfrequency", "awg"):
+            self.awg.setfrequency(self.awg_channel, float(freq))
+
+    def measure_point(self, freq):
+        """
+        Sets the generator to the given frequency and measures the DUT.
+        Returns the amplitude (normalized if needed), the phase (None if not measured) and the time it took to settle.
+        """
+        with self.tracer.span("point", freq=float(freq)):
+            return self._measure_point(freq)
+
+    def _measure_point(self, freq):
+        if self.awg_worker:
+            awg_done = self.awg_worker.submit(self.set_frequency, freq)
+        else:
+            self.set_frequency(freq)
+            start = time.monotonic()
+
+        if not self.manual_settings:
+            # Set the range for the new point before it is measured, using the amplitude predicted from the previous points.
+            # The scale is only changed, if the predicted signal would not span 1 to 6 divs.
+            self.set_timebase(freq)
+            predicted = bodeanalysis.predict_amplitude(self.range_freqs, self.range_volts, freq)
+            if predicted is not None and not self.current_scale <= predicted <= 6 * self.current_scale:
+                self.set_scale(predicted)
+
+        # The generator has to be at the new frequency, before we can measure
+        if self.awg_worker:
+            with self.tracer.span("wait for awg"):
+                awg_done.result()
+            start = time.monotonic()
+
+        if self.manual_settings:
+            result, volt, phase = self.wait_and_read(freq, start)
+        else:
+            for retry in range(4):
+                result, volt, phase = self.wait_and_read(freq, start)
+
+                # Retry with a bigger range if the signal was clipped, with the default range (and then smaller ones) if there
+                # was no valid signal or with a smaller range if the signal is too small to be measured
+                if volt is None:
+                    changed = (retry == 0 and self.set_scale(self.voltage)) or self.set_scale(self.current_scale / 5)
+                elif volt >= 7 * self.current_scale:
+                    changed = self.set_scale(8 * self.current_scale)
+                elif volt < self.current_scale / 5:
+                    changed = self.set_scale(volt)
+                else:
+                    break
+
+                if not changed:
+                    break
+
+            if volt:
+                self.range_freqs.append(freq)
+                self.range_volts.append(volt)
+
+        settle_time = time.monotonic() - start
+
+        return result, phase, settle_time
+
+    def _hw_sweep(self, freqs, min_freq, max_freq, sweep_time, linear):
+        """Measures with the sweep function of the generator and one long scope record, yields all points at the end."""
+        sweep_mode = "SWEEP_CH%d" % self.awg_channel
+        wave_mode = "WAVE_CH%d" % self.awg_channel
+
+        # CH2 is not ranged during the sweep, so measure a few points before: the smallest scale where the largest
+        # of them spans at most 6 divs keeps small signals above the ADC resolution and leaves room for peaks between the points
+        if self.log:
+            self.log("Ranging CH2")
+        with self.tracer.span("ranging"):
+            for freq in self.frequencies(min_freq, max_freq, min(len(freqs), 10), linear):
+                self.measure_point(freq)
+        if self.range_volts:
+            scale = min([scale for scale in self.ch2_scales if 6 * scale >= max(self.range_volts)] or [max(self.ch2_scales)])
+            self.set_scale(2 * scale)
+
+        # Program the sweep of the generator
+        self.awg.setmode(sweep_mode)
+        with self.awg.transaction():
+            self.awg.sweep_setstartfreq(min_freq)
+            self.awg.sweep_setendfreq(max_freq)
+            self.awg.sweep_settime(sweep_time)
+            self.awg.sweep_setdirection("RISE")
+            self.awg.sweep_setmode("LINEAR" if linear else "LOGARITHM")
+
+        # The scope record (12 divs) has to contain the complete sweep
+        self.current_timebase = min([scale for scale in self.scope.possible_timebase_scale_values if scale >= sweep_time * 1.2 / 12] or [self.scope.MAX_TIMEBASE_SCALE])
+        self.scope.timebase_scale = self.current_timebase
+
+        if self.log:
+            self.log("Sweeping for %.1f s" % sweep_time)
+        with self.tracer.span("sweep"):
+            self.scope.run()
+            self.awg.sweep_start()
+            time.sleep(sweep_time)
+            self.scope.stop()
+
+        self.awg.sweep_stop()
+        self.awg.setmode(wave_mode)
+
+        # Read the whole record from scope memory
+        if self.log:
+            self.log("Reading scope memory")
+        with self.tracer.span("read memory", "scope"):
+            ch1 = np.array(self.scope.get_waveform_samples(1, mode="RAW"))
+            ch2 = np.array(self.scope.get_waveform_samples(2, mode="RAW"))
+            preamble = self.scope.waveform_preamble_dict
+        t = preamble['xorig'] + preamble['xinc'] * np.arange(len(ch2))
+
+        # The acquisition was stopped, start it again for the next measurements
+        self.scope.run()
+
+        if max_freq > 0.25 / preamble['xinc'] and self.log:
+            self.log("Warning: Sample rate of %g Sa/s is too low for MAX_FREQ, increase the memory depth of the scope!" % (1 / preamble['xinc']))
+
+        # Parts of the record without data (e.g. before the acquisition started) are NaN
+        valid = np.isfinite(ch1) & np.isfinite(ch2)
+        with self.tracer.span("reconstruct"):
+            volts0, volts, phases = bodeanalysis.reconstruct_sweep(t[valid], ch1[valid], ch2[valid], freqs, min_freq, max_freq, sweep_time, not linear)
+
+        if self.normalize:
+            volts = volts / volts0
+
+        missing = np.count_nonzero(np.isnan(volts))
+        if missing and self.log:
+            self.log("Warning: %d of %d points could not be reconstructed (outside of the record or signal too small)" % (missing, len(freqs)))
+
+        timestamp = time.time()
+        for freq, volt, phase in zip(freqs, volts, phases):
+            yield SweepPoint(float(freq), float(volt), float(phase), None, self.current_scale, self.current_timebase, timestamp)
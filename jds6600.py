@@ -15,6 +15,20 @@
 
 import serial
 import binascii
+import hashlib
+import contextlib
+import collections
+import itertools
+import queue
+import threading
+import time
+import warnings
+
+# numpy is optional, it is only needed for the array functions of the arbitrary waveforms
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 
 ###########
@@ -39,6 +53,37 @@ class WrongMode(RuntimeError):
 	pass
 
 
+##########
+#  State #
+##########
+
+# settings of one channel, as returned by getstate()
+# waveform is a (id, name) tuple, like returned by getwaveform()
+channelstate=collections.namedtuple("channelstate",("enabled","waveform","frequency","amplitude","offset","dutycycle"))
+
+# settings of the device, as returned by getstate()
+# mode is a (id, name) tuple, like returned by getmode()
+devicestate=collections.namedtuple("devicestate",("channel1","channel2","phase","mode"))
+
+# precomputed command prefixes of all registers (0 to 99) as bytes:
+# "r": register read ":rNN=" (also the start of the reply), "w": register write ":wNN="
+# "b": arbitrary waveform read ":bNN=", "a": arbitrary waveform write ":aNN="
+_prefixes={c: tuple((":%s%02d=" % (c,reg)).encode() for reg in range(100)) for c in "rwba"}
+
+# shortest possible reply lines (see jds6600.__readline): ":ok\n", ":rNN=0.\n" and
+# ":bNN=" followed by 2048 single digit values separated by "," and ".\n"
+_replysize={"ok": 4, "r": 8, "b": 5+2*2048+1}
+
+# state of the transaction of one thread (see jds6600.transaction)
+class _txstate(threading.local):
+	queue=None
+	depth=0
+
+# priority of the commands of one thread (see jds6600.priority)
+class _prioritystate(threading.local):
+	priority=1
+
+
 #################
 # jds6600 class #
 #################
@@ -46,9 +91,14 @@ class WrongMode(RuntimeError):
 class jds6600:
 	'jds6600 top-level class'
 
-	# serial device (opened during object init))
+	# serial device (opened during object init, every object has its own)
 	ser = None
 
+	# priorities of the commands in thread-safe mode (see priority)
+	PRIORITY_HIGH=0
+	PRIORITY_NORMAL=1
+	PRIORITY_LOW=2
+
 	# commands
 	DEVICETYPE=0
 	SERIALNUMBER=1
@@ -161,18 +211,78 @@ class jds6600:
 	# language
 	__system_language=("ENGLISH","CHINESE")
 
+
+	# registers tracked by the shadow-register cache
+	# note: MODE is read in another format then it is written, see setmode
+	__cacheregs=(WAVEFORM1,WAVEFORM2,FREQUENCY1,FREQUENCY2,AMPLITUDE1,AMPLITUDE2,OFFSET1,OFFSET2,MODE)
+
 	###############
 	# oonstructor #
 	###############
 
-	def __init__(self,fname):
-			jds6600.ser = serial.Serial(
-				port= fname,
-				baudrate=115200,
-				parity=serial.PARITY_NONE,
-				stopbits=serial.STOPBITS_ONE,
-				bytesize=serial.EIGHTBITS,
-				timeout=1		)
+	# fname is the name of the serial port, or an already opened serial.Serial like
+	# object (e.g. a simulated device)
+	# with threadsafe, the object can be used from several threads (see Part 17)
+	# retries is the number of times an exchange is repeated after an error of
+	# the serial line, backoff the wait before the first repetition (see Part 18)
+	# timeout is the time in seconds a reply line to a register read or write
+	# may take, arbtimeout the same for the arbitrary waveform reads and writes
+	def __init__(self,fname,cache=False,threadsafe=False,retries=0,backoff=0.05,timeout=1.0,arbtimeout=1.0):
+			if type(threadsafe) != bool: raise TypeError(threadsafe)
+			if type(retries) != int: raise TypeError(retries)
+			if retries < 0: raise ValueError(retries)
+			if not (timeout > 0): raise ValueError(timeout)
+			if not (arbtimeout > 0): raise ValueError(arbtimeout)
+
+			if type(fname) == str:
+				self.ser = serial.Serial(
+					port= fname,
+					baudrate=115200,
+					parity=serial.PARITY_NONE,
+					stopbits=serial.STOPBITS_ONE,
+					bytesize=serial.EIGHTBITS,
+					timeout=timeout		)
+			else:
+				self.ser = fname
+			# end else - if
+
+			# shadow-register cache (None = disabled)
+			# maps register -> last known value, in the format returned by __getdata
+			self.__cache = {} if cache == True else None
+			# hash of the last uploaded arbitrary waveform per slot (only used when the cache is enabled)
+			self.__arbcache = {}
+
+			# queued write commands of an open transaction (None = no transaction)
+			# every thread has its own transaction
+			self.__tx = _txstate()
+
+			# I/O worker of the thread-safe mode (None = disabled)
+			# all exchanges with the device are done by this thread, in the
+			# order of their priority (see Part 17)
+			self.__worker = None
+			self.__requests = None
+			self.__requestcount = None
+			self.__priority = _prioritystate()
+			if threadsafe == True:
+				self.__requests = queue.PriorityQueue()
+				self.__requestcount = itertools.count()
+				self.__worker = threading.Thread(target=self.__ioworker,name="jds6600 I/O",daemon=True)
+				self.__worker.start()
+			# end if
+
+			# tracer recording the time of every command (None = disabled)
+			self.__tracer = None
+
+			# received data which is not read yet (see __readline)
+			self.__rxbuffer = b""
+			self.__timeout = timeout
+			self.__arbtimeout = arbtimeout
+
+			# repetition of failed exchanges
+			self.__retries = retries
+			self.__backoff = backoff
+			self.__retrycount = 0
+			self.__reconnectcount = 0
 	# end constructor
 
 
@@ -231,15 +341,14 @@ class jds6600:
 		if type(n) != int: raise TypeError(n)
 		if a not in (0,1): raise ValueError(a)
 
-		regtxt=self.__reg2txt(reg)
 		if (n < 1):
 			raise ValueError(n)
 
 		if a == 0:
 			# a (arbitrary waveform) is 0  -> register read
-			c='r' # register
+			prefix=_prefixes["r"][reg] # register
 		else:
-			c='b' # arbitrary waveform
+			prefix=_prefixes["b"][reg] # arbitrary waveform
 			# for n to 1
 			n=1
 		# end else - if
@@ -248,8 +357,7 @@ class jds6600:
 		n -= 1
 
 		if self.ser.is_open == True:
-			tosend=":"+c+regtxt+"="+str(n)+"."+chr(0x0a)
-			self.ser.write(tosend.encode())
+			self.ser.write(prefix+b"%d.\n" % n)
 	# end __sendreadcmd
 
 
@@ -259,13 +367,21 @@ class jds6600:
 		if type(n) != int: raise ValueError(n)
 		if a not in (0,1): raise ValueError(a) # a=0-> register read, a=1 -> arbitrary waveform read
 
+		# register reads are parsed as bytes
+		if a == 0:
+			if n == 1:
+				return self.__parsereply(reg,self.__readline(self.__timeout,_replysize["r"]))
+			# end if
+			return [self.__parsereply(reg+l,self.__readline(self.__timeout,_replysize["r"])) for l in range(n)]
+		# end if
+
 		ret=[] # return value
 
 		c = int(reg) # counter
 		c_expect=self.__reg2txt(c)
 		for l in range(n):
 			# get one line responds from serial device
-			retserial=self.ser.readline()
+			retserial=self.__readline(self.__timeout)
 			# convert bytearray into string, then strip off terminating \n and \r
 			retserial=str(retserial,'utf-8').rstrip()
 
@@ -308,6 +424,208 @@ class jds6600:
 	# end __get responds and parse 1
 
 
+	# parse reply of register read (as bytes), without converting it into a string
+	# ":rNN=v1,v2.\r\n" -> v1 (for one value) or [v1,v2] (for more values)
+	def __parsereply(self,reg,data):
+		prefix=_prefixes["r"][reg]
+
+		if not data.startswith(prefix):
+			if b"=" not in data:
+				raise FormatError("Parsing Returned data: Invalid format, missing \"=\"")
+			# end if
+			errmsg="Parsing Return data: send/received reg mismatch: "+str(data,'utf-8','replace').rstrip()+" / expected "+str(prefix[:-1],'utf-8')
+			raise FormatError(errmsg)
+		# end if
+
+		end=data.find(b".",len(prefix))
+		if end < 0:
+			raise FormatError("Parsing Returned data: Invalid format, missing \".\"")
+		# end if
+		if data.find(b".",end+1) >= 0:
+			raise FormatError("Parsing Returned data: Invalid format, too many \".\"")
+		# end if
+
+		try:
+			values=[int(v) for v in data[len(prefix):end].split(b",")]
+		except ValueError:
+			raise UnexpectedValueError(data)
+		# end try
+
+		return values[0] if len(values) == 1 else values
+	# end __parsereply
+
+
+	# parse reply of arbitrary waveform read (as bytes), directly into a numpy array
+	# ":bNN=v1,v2,...,v2048,." -> uint16 array of 2048 elements
+	def __parsearbwave(self,waveid,data):
+		prefix=_prefixes["b"][waveid]
+
+		if not data.startswith(prefix):
+			errmsg="Parsing Return data: send/received reg mismatch: "+str(data[:8],'utf-8','replace')+" / expected "+str(prefix,'utf-8')
+			raise FormatError(errmsg)
+		# end if
+
+		# strip off prefix, terminating "." (and \n and \r) and the empty field after the last value
+		data=data[len(prefix):].rstrip()
+		if not data.endswith(b"."):
+			raise FormatError("Parsing Returned data: Invalid format, missing \".\"")
+		# end if
+		data=data[:-1]
+		if data.endswith(b","): data=data[:-1]
+
+		# numpy warns (and stops) on data which is not a number
+		try:
+			with warnings.catch_warnings():
+				warnings.simplefilter("error",DeprecationWarning)
+				# parsed as int64, as uint16 would silently wrap values out of range
+				wave=numpy.fromstring(data,dtype=numpy.int64,sep=",")
+			# end with
+		except (ValueError,DeprecationWarning):
+			raise UnexpectedValueError(data)
+		# end try
+
+		if len(wave) != 2048:
+			raise UnexpectedValueError(data)
+		# end if
+
+		# all values are between 0 and 4095
+		if (wave.min() < 0) or (wave.max() > 4095):
+			raise UnexpectedValueError(data)
+		# end if
+
+		return wave.astype(numpy.uint16)
+	# end __parsearbwave
+
+
+	# send read command and get parsed responds (done by the I/O worker in thread-safe mode)
+	# the cache is updated here, so no other exchange can change the registers
+	# between the read and the update of the cache
+	def __read(self,reg,n,a):
+		# send "read" commandline for "n" lines 
+		# copy "a" parameter from calling function
+		self.__sendreadcmd(reg,n,a)
+
+		ret=self.__getrespondsandparse(reg,n,a)
+
+		# update cache with what we have just read
+		if (a == 0) and (self.__cache != None):
+			for (i,val) in enumerate([ret] if n == 1 else ret):
+				self.__cache_store(reg+i,val)
+			# end for
+		# end if
+
+		return ret
+	# end __read
+
+
+	# send read command of arbitrary waveform and parse it into a numpy array
+	def __readarbwave(self,waveid):
+		self.__sendreadcmd(waveid,1,1)
+		return self.__parsearbwave(waveid,self.__readline(self.__arbtimeout,_replysize["b"]))
+	# end __readarbwave
+
+
+	# send write command and check the "ok", unless the cache already contains the value
+	# (done by the I/O worker in thread-safe mode, so no other exchange can come
+	# between the check, the write and the update of the cache)
+	# cache is the dict holding value at key, None if the write is not cached
+	# with skip=False the write is always sent
+	# returns False if the write was skipped
+	def __writecached(self,data,timeout,cache,key,value,skip):
+		if (skip == True) and (cache != None) and (cache.get(key) == value):
+			return False
+		# end if
+
+		self.__write(data,1,timeout)
+
+		if cache != None:
+			cache[key]=value
+		# end if
+		return True
+	# end __writecached
+
+
+	# send n write commands and check the n "ok" replies
+	def __write(self,data,n,timeout):
+		self.ser.write(data)
+
+		# read all replies, so the serial line stays in sync if one of them is wrong
+		if n == 1:
+			replies=(self.__readline(timeout,_replysize["ok"]),)
+		else:
+			replies=[self.__readline(timeout,_replysize["ok"]) for i in range(n)]
+		# end else - if
+		for ret in replies:
+			if ret != b":ok\r\n" and ret.rstrip() != b":ok":
+				raise UnexpectedReplyError(str(ret,'utf-8','replace').rstrip())
+			# end if
+		# end for
+	# end __write
+
+
+	# read one line from the device
+	# All bytes available are read at once and split into lines here (instead
+	# of serial.readline(), which reads byte by byte). size is the shortest
+	# possible length of the line, so it is read with one call of the port
+	# when nothing was received yet.
+	# timeout is the time waited for the line, after that the data received so
+	# far is returned (like serial.readline() does). It is the timeout of each
+	# read of the port (only changed when needed, as this reconfigures the
+	# port), and no further read is started after it, so a line arriving
+	# slowly takes at most about twice the timeout
+	def __readline(self,timeout,size=1):
+		ser=self.ser
+		if ser.timeout != timeout:
+			ser.timeout=timeout
+		# end if
+
+		# the buffer is kept as bytes: a reply read at once is returned without a copy
+		buffer=self.__rxbuffer
+		deadline=None
+		while True:
+			end=buffer.find(b"\n")
+			if end >= 0:
+				self.__rxbuffer=buffer[end+1:]
+				return buffer[:end+1]
+			# end if
+
+			if deadline == None:
+				deadline=time.monotonic()+timeout
+			elif time.monotonic() >= deadline:
+				# timeout
+				break
+			# end elif - if
+
+			data=ser.read(max(ser.in_waiting,size-len(buffer),1))
+			if data == b"":
+				# timeout
+				break
+			# end if
+			buffer += data
+		# end while
+
+		self.__rxbuffer=b""
+		return buffer
+	# end readline
+
+
+	# read arbitrary waveform into a numpy array
+	def __getarbwave(self,waveid):
+		# queued writes of a transaction must be done before reading
+		self.__txflush()
+
+		if self.__tracer != None: tstart=time.perf_counter()
+
+		wave=self.__run(self.__readarbwave,waveid)
+
+		if self.__tracer != None:
+			self.__tracer.add("read arb "+str(waveid),"awg",tstart,time.perf_counter(),{"n": 1})
+		# end if
+
+		return wave
+	# end __getarbwave
+
+
 	# get data
 	def __getdata(self,reg, n=1, a=0):
 		if type(reg) != int: raise TypeError(reg)
@@ -317,45 +635,148 @@ class jds6600:
 		# a=0 -> register read
 		# a=1 -> arbitrary waveform read
 
-		# send "read" commandline for "n" lines 
-		# copy "a" parameter from calling function
-		self.__sendreadcmd(reg,n,a)
+		# single register reads of cached registers are answered locally
+		# (the cache is only updated by the exchanges, see __read and __writecached)
+		if (a == 0) and (n == 1):
+			ret=self.__cache_get(reg)
+			if ret != None:
+				return ret
+			# end if
+		# end if
+
+		# queued writes of a transaction must be done before reading
+		self.__txflush()
+
+		if self.__tracer != None: tstart=time.perf_counter()
 
-		return self.__getrespondsandparse(reg,n,a)
+		ret=self.__run(self.__read,reg,n,a)
+
+		if self.__tracer != None:
+			self.__tracer.add(("read reg " if a == 0 else "read arb ")+str(reg),"awg",tstart,time.perf_counter(),{"n": n})
+		# end if
+
+		return ret
 	# end __getdata 1
 
 	
 	# send write command and wait for "ok"
-	def __sendwritecmd(self,reg, val, a=0):
+	# cacheval is the value stored in the cache instead of val: for registers
+	# read in another format then they are written (MODE) and the hash of an
+	# arbitrary waveform, whose upload is skipped if the slot already contains it
+	def __sendwritecmd(self,reg, val, a=0, cacheval=None):
 		# note: a = "arbitrary waveform?": 0 = no (register write), 1 = yes (arb. waveform write)
-		# add a "0" to the command if it one single character
-		reg=self.__reg2txt(reg)
+		regnum=reg
 
-		# command to send: "w" for register write, "b" for arbitrary waveform write
+		# command to send: "w" for register write, "a" for arbitrary waveform write
 		cmd = "w" if a == 0 else "a"
 
 		if self.ser.is_open == True:
-			if type(val) == int: val = str(val)
-			if type(val) != str: raise TypeError(val)
+			# the value is formatted directly as bytes (str is accepted as well)
+			if type(val) == int: val = b"%d" % val
+			elif type(val) == str: val = val.encode()
+			elif type(val) != bytes: raise TypeError(val)
+
+			# writes that do not change a cached register (or arbitrary waveform
+			# slot) are skipped: cache is the dict holding the value, None if the
+			# write is not cached
+			# (MODE is always written, as writing it stops the running action)
+			cache=None
+			if self.__cache != None:
+				skip=(regnum != jds6600.MODE) or (a == 1)
+				if (a == 0) and (regnum in jds6600.__cacheregs):
+					cache=self.__cache
+					if cacheval == None: cacheval=self.__cache_parse(val)
+				elif (a == 1) and (cacheval != None):
+					cache=self.__arbcache
+				# end elif - if
+			# end if
 
-			tosend=":"+cmd+reg+"="+val+"."+chr(0x0a)
-			self.ser.write(tosend.encode())
+			tosend=_prefixes[cmd][regnum]+val+b".\n"
+
+			# in a transaction: queue command, the "ok" is checked when the transaction is flushed
+			# (the cached values of a failed transaction are invalidated, see __txflush)
+			if self.__tx.queue != None:
+				if cache != None:
+					if (skip == True) and (cache.get(regnum) == cacheval):
+						return
+					# end if
+					cache[regnum]=cacheval
+				# end if
+				self.__tx.queue.append(tosend)
+				return
+			# end if
 
-			# wait for "ok"
+			if self.__tracer != None: tstart=time.perf_counter()
 
-			# get one line responds from serial device
-			ret=self.ser.readline()
-			# convert bytearray into string, then strip off terminating \n and \r
-			ret=str(ret,'utf-8').rstrip()
+			# send and wait for "ok"
+			timeout=self.__timeout if a == 0 else self.__arbtimeout
+			if cache == None:
+				self.__run(self.__write,tosend,1,timeout)
+				written=True
+			else:
+				written=self.__run(self.__writecached,tosend,timeout,cache,regnum,cacheval,skip)
+			# end else - if
 
-			if ret != ":ok":
-				raise UnexpectedReplyError(ret)
+			if (self.__tracer != None) and (written == True):
+				self.__tracer.add(("write reg " if a == 0 else "write arb ")+str(regnum),"awg",tstart,time.perf_counter())
 			# end if
 
 		#end if
 	# end __sendwritecmd
 
 
+	# send all queued commands of a transaction at once, then check all "ok"
+	def __txflush(self):
+		if not self.__tx.queue: return
+
+		commands=self.__tx.queue
+		self.__tx.queue=[]
+
+		if self.__tracer != None: tstart=time.perf_counter()
+
+		try:
+			# storing an arbitrary waveform takes longer
+			timeout=self.__arbtimeout if any(c.startswith(b":a") for c in commands) else self.__timeout
+			self.__run(self.__write,b"".join(commands),len(commands),timeout)
+		except BaseException:
+			# we do not know which writes succeeded (also after an error of the
+			# serial port or an interrupt), so forget cached values
+			self.cache_invalidate()
+			raise
+		# end try
+
+		if self.__tracer != None:
+			self.__tracer.add("transaction","awg",tstart,time.perf_counter(),{"writes": len(commands)})
+		# end if
+	# end __txflush
+
+
+	#####
+	# shadow-register cache support functions
+
+	# convert a written value (b"123" or b"123,0") into the format returned by __getdata
+	def __cache_parse(self,val):
+		vals=[int(v) for v in val.split(b",")]
+		return vals[0] if len(vals) == 1 else vals
+	# end cache parse
+
+	# get last known value of a register, None if unknown or not cached
+	def __cache_get(self,reg):
+		if self.__cache == None: return None
+
+		return self.__cache.get(reg)
+	# end cache get
+
+	# store value of a register (only for registers tracked by the cache)
+	def __cache_store(self,reg,val):
+		if self.__cache == None: return
+
+		if reg in jds6600.__cacheregs:
+			self.__cache[reg]=val
+		# end if
+	# end cache store
+
+
 	#####
 	# high-level support function
 
@@ -385,10 +806,10 @@ class jds6600:
 			tosend=":r"+regtxt+"="+str(count)+"."+chr(0x0a)
 			self.ser.write(tosend.encode())
 
-			ret=self.ser.readline()
+			ret=self.__readline(self.__timeout)
 			while ret != b'':
 				print(str(ret))
-				ret=self.ser.readline()
+				ret=self.__readline(self.__timeout)
 			# end while 
 		# end if
 	# end readregister
@@ -402,10 +823,10 @@ class jds6600:
 			tosend=":w"+regtxt+"="+value+"."+chr(0x0a)
 			self.ser.write(tosend.encode())
 
-			ret=self.ser.readline()
+			ret=self.__readline(self.__timeout)
 			while ret != b'':
 				print(str(ret))
-				ret=self.ser.readline()
+				ret=self.__readline(self.__timeout)
 			# end while 
 		# end if
 
@@ -501,6 +922,11 @@ class jds6600:
 		#WAVEFORM for channel 2 is WAVEFORM1 + 1
 		waveform=self.__getdata(jds6600.WAVEFORM1+channel-1)
 
+		return self.__decodewaveform(waveform)
+	# end getwaveform
+
+	# convert waveform register value to (id, name)
+	def __decodewaveform(self,waveform):
 		# waveform 0 to 16 are in "wave" list, 101 to 160 are in __awave
 		try:
 			return (waveform,jds6600.__wave[waveform])
@@ -511,7 +937,7 @@ class jds6600:
 			return (waveform,jds6600.__awave[waveform-101])
 		except IndexError:
 			raise UnexpectedValueError(waveform)
-	# end getwaveform
+	# end decode waveform
 
 	# get frequency _with multiplier
 	def getfrequency_m(self,channel):
@@ -538,6 +964,11 @@ class jds6600:
 
 		(f1,f2)=self.__getdata(jds6600.FREQUENCY1+channel-1)
 
+		return self.__decodefrequency(f1,f2)
+	# end function getfreq
+
+	# convert frequency register value to Hz
+	def __decodefrequency(self,f1,f2):
 		# parse multiplier (value after ","): 0=Hz, 1=KHz,2=MHz, 3=mHz,4=uHz)
 		# note1: frequency unit is Hz / 100
 		# note2: multiplier 1 (khz) and 2 (mhz) only changes the visualisation on the
@@ -550,7 +981,7 @@ class jds6600:
 			# unexptected value of frequency multiplier
 			raise UnexpectedValueError(f2)
 		# end elsif
-	# end function getfreq
+	# end decode frequency
 
 
 	# get amplitude
@@ -597,6 +1028,43 @@ class jds6600:
 	# end getphase
 
 	
+	# get all basic parameters of both channels with one single read
+	# returns a (immutable) devicestate
+	def getstate(self):
+		# registers CHANNELENABLE (20) up to MODE (33)
+		regs=self.__getdata(jds6600.CHANNELENABLE,jds6600.MODE-jds6600.CHANNELENABLE+1)
+
+		# get register value from list
+		def r(reg):
+			return regs[reg-jds6600.CHANNELENABLE]
+		# end r
+
+		try:
+			enable=[(False,True)[e] for e in r(jds6600.CHANNELENABLE)]
+		except IndexError:
+			raise UnexpectedValueError(r(jds6600.CHANNELENABLE))
+		# end try
+
+		channels=[]
+		for ch in (0,1):
+			(f1,f2)=r(jds6600.FREQUENCY1+ch)
+			channels.append(channelstate(
+				enabled=enable[ch],
+				waveform=self.__decodewaveform(r(jds6600.WAVEFORM1+ch)),
+				frequency=self.__decodefrequency(f1,f2),
+				# amplitude unit is mV
+				amplitude=r(jds6600.AMPLITUDE1+ch)/1000,
+				# offset unit is 10 mV, and then add 1000
+				offset=(r(jds6600.OFFSET1+ch)-1000)/100,
+				# dutycycle unit is 0.1 %
+				dutycycle=r(jds6600.DUTYCYCLE1+ch)/10))
+		# end for
+
+		# phase unit is 0.1 degrees
+		return devicestate(channel1=channels[0],channel2=channels[1],phase=r(jds6600.PHASE)/10,mode=self.__decodemode(r(jds6600.MODE)))
+	# end getstate
+
+
 	##################################
 	# Part 3: writing basic parameters
 
@@ -607,11 +1075,11 @@ class jds6600:
 		if type(ch2) != bool: raise TypeError(ch1)
 
 		# channel 1
-		if ch1 == True: enable = "1"
-		else: enable = "0" # end else - if
+		if ch1 == True: enable = b"1"
+		else: enable = b"0" # end else - if
 
-		if ch2 == True: enable += ",1"
-		else: enable += ",0" # end else - if
+		if ch2 == True: enable += b",1"
+		else: enable += b",0" # end else - if
 
 		# write command
 		self.__sendwritecmd(jds6600.CHANNELENABLE,enable)
@@ -742,7 +1210,7 @@ class jds6600:
 
 		# round to nearest 0.01 value
 		freq=int(round(freq*100/jds6600.__freqmultiply[multiplier]))
-		value=str(freq)+","+str(multiplier)
+		value=b"%d,%d" % (freq,multiplier)
 
 		self.__sendwritecmd(jds6600.FREQUENCY1+channel-1,value)
 	# end set frequency (with multiplier)
@@ -831,7 +1299,11 @@ class jds6600:
 	def getmode(self):
 		mode=self.__getdata(jds6600.MODE)
 
+		return self.__decodemode(mode)
+	# end getmode
 
+	# convert mode register value to (id, name)
+	def __decodemode(self,mode):
 		# mode is in the list "modes". mode-name "" means undefinded
 		mode=int(mode)>>3
 
@@ -849,7 +1321,7 @@ class jds6600:
 		# modeid 4
 		raise UnexpectedValueError(mode)
 
-	# end getmode
+	# end decode mode
 
 
 	# set mode
@@ -899,7 +1371,13 @@ class jds6600:
 		# endif
 
 		# set mode
-		self.__sendwritecmd(jds6600.MODE,modeid)
+		# mode register is read as index in "modes" list, shifted by 3 bits
+		for (i,(mid,mtxt)) in enumerate(jds6600.__modes):
+			if mid == modeid:
+				self.__sendwritecmd(jds6600.MODE,modeid,cacheval=i<<3)
+				break
+			# end if
+		# end for
 
 		# if new mode is "burst", reset burst counter
 		if modeid == 9:
@@ -1370,6 +1848,10 @@ class jds6600:
 
 		# action start BURST mode
 		self.__setaction("SWEEP")
+
+		# the device changes the frequency while sweeping
+		self.cache_invalidate(jds6600.FREQUENCY1)
+		self.cache_invalidate(jds6600.FREQUENCY2)
 	# end sweep_start
 		
 
@@ -1469,9 +1951,9 @@ class jds6600:
 
 		# convert from s to ns/us, if needed
 		if normalised == 1:
-			data = str(round(data * multi[multiplier]))+","+str(multiplier)
+			data = b"%d,%d" % (round(data * multi[multiplier]),multiplier)
 		else:
-			data = str(int(data))+","+str(multiplier)
+			data = b"%d,%d" % (int(data),multiplier)
 		# end if
 
 		# done: now write
@@ -1795,11 +2277,14 @@ class jds6600:
 		# create command to send
 		sync=[freq,wave,ampl,duty,offs]
 		for i in range(5):
-			sync[i] = '1' if sync[i] == True else '0'
+			sync[i] = b'1' if sync[i] == True else b'0'
 
 
 		# merge all 5 elements in one command, seperated by ","
-		self.__sendwritecmd(jds6600.SYSTEM_SYNC,",".join(sync))
+		self.__sendwritecmd(jds6600.SYSTEM_SYNC,b",".join(sync))
+
+		# synced channels change each others registers
+		self.cache_invalidate()
 	# end set sync
 
 	# set maximum number of arbitrary waveforms
@@ -1837,6 +2322,9 @@ class jds6600:
 
 		# write profile to "PROFILE_LOAD"
 		self.__sendwritecmd(jds6600.PROFILE_LOAD,profile)
+
+		# loading a profile changes all settings
+		self.cache_invalidate()
 	# end profile load
 
 	def system_clearprofile(self,profile):
@@ -1860,34 +2348,458 @@ class jds6600:
 		# waveid is between 1 and 60
 		if not(1 <= waveid <= 60): raise ValueError(waveid)
 
+		# with numpy, the fast parser is used
+		if numpy != None:
+			return self.__getarbwave(waveid).tolist()
+		# end if
+
 		# getdata, reg=waveform id, data = 1, a=1 (register/waveform selector)
 		return self.__getdata(waveid,1,a=1)
 	# end get arbtrary waveform
 
+	# get arbitrary waveform as numpy array (uint16, 2048 elements)
+	def arb_getwave_array(self,waveid):
+		if numpy == None: raise ImportError("numpy is needed for arb_getwave_array")
+		if type(waveid) != int: raise TypeError(waveid)
+
+		# waveid is between 1 and 60
+		if not(1 <= waveid <= 60): raise ValueError(waveid)
+
+		return self.__getarbwave(waveid)
+	# end get arbitrary waveform as array
+
+	# get all 60 arbitrary waveforms as one numpy array (uint16, 60 x 2048 elements)
+	# row n contains waveform n+1
+	def arb_getall(self):
+		if numpy == None: raise ImportError("numpy is needed for arb_getall")
+
+		waves=numpy.empty((60,2048),dtype=numpy.uint16)
+		for waveid in range(1,61):
+			waves[waveid-1]=self.__getarbwave(waveid)
+		# end for
+
+		return waves
+	# end get all arbitrary waveforms
+
 
 	def arb_setwave(self,waveid,wave):
 		if type(waveid) != int: raise TypeError(waveid)
-		if (type(wave) != tuple) and (type(wave) != list): raise TypeError(wave)
+		if (type(wave) != tuple) and (type(wave) != list) and not ((numpy != None) and isinstance(wave,numpy.ndarray)): raise TypeError(wave)
 		
 		# waveid is between 1 and 60
 		if not(1 <= waveid <= 60): raise ValueError(waveid)
 
-		# wave should be a list or tuple of 2048 elements, all integers, with a value between 0 and 4095
+		# wave should be a list, tuple or numpy array of 2048 elements, all integers, with a value between 0 and 4095
 		if len(wave) != 2048: raise ValueError(wave)
 
-		tosend=""
-		for val in wave:
-			if type(val) != int: raise ValueError(wave)
-			if not (0 <= val <= 4095): raise ValueError(wave)
+		if numpy != None:
+			# vectorized check of all values
+			values=numpy.asarray(wave)
+			if (values.ndim != 1) or not numpy.issubdtype(values.dtype,numpy.integer): raise ValueError(wave)
+			if (values.min() < 0) or (values.max() > 4095): raise ValueError(wave)
+			wave=values.tolist()
+		else:
+			for val in wave:
+				if type(val) != int: raise ValueError(wave)
+				if not (0 <= val <= 4095): raise ValueError(wave)
+			# end for
+		# end else - if
+
+		tosend=",".join(map(str,wave)).encode()
 
-			tosend += (str(val) if tosend=="" else ","+str(val))
-		# end for
+		# the upload is skipped if the slot already contains this waveform
+		digest=hashlib.sha1(tosend).digest()
 			
 		# write waveform, reg=waveform id, data = waveform, a=1 (register/waveform selector)
-		self.__sendwritecmd(waveid,tosend,a=1)
+		self.__sendwritecmd(waveid,tosend,a=1,cacheval=digest)
 
 	# end set arbirtary waveform
 
+	#######################
+	# Part 13: shadow-register cache
+
+	# The cache keeps the last known value of the MODE, WAVEFORM, FREQUENCY,
+	# AMPLITUDE and OFFSET registers, so reads of these registers (like the
+	# mode check in setfrequency) and writes that would not change anything
+	# do not need a round trip to the device.
+	# It also remembers a hash of the arbitrary waveforms uploaded with
+	# arb_setwave, so uploading the same waveform again to a slot is skipped.
+	# When the settings are changed on the front panel, the cache must be
+	# invalidated (or synced) to get the correct values again.
+
+	# enable or disable the cache
+	def cache_enable(self,enable=True):
+		if type(enable) != bool: raise TypeError(enable)
+
+		if enable == True:
+			if self.__cache == None:
+				self.__cache={}
+			# end if
+		else:
+			self.__cache=None
+			self.__arbcache.clear()
+		# end else - if
+	# end cache enable
+
+	# is the cache enabled?
+	def cache_isenabled(self):
+		return self.__cache != None
+	# end cache is enabled
+
+	# forget the cached value of one register (or of all registers and
+	# arbitrary waveforms if reg is None)
+	def cache_invalidate(self,reg=None):
+		if self.__cache == None: return
+
+		if reg == None:
+			self.__cache.clear()
+			self.__arbcache.clear()
+		else:
+			if type(reg) != int: raise TypeError(reg)
+			self.__cache.pop(reg,None)
+		# end else - if
+	# end cache invalidate
+
+	# (re)read all cached registers from the device
+	def cache_sync(self):
+		if self.__cache == None: return
+
+		self.__cache.clear()
+		# one read for registers WAVEFORM1 up to MODE, values are stored by __getdata
+		self.__getdata(jds6600.WAVEFORM1,jds6600.MODE-jds6600.WAVEFORM1+1)
+	# end cache sync
+
+	#######################
+	# Part 14: transactions
+
+	# Inside a transaction, write commands are queued and send with one single
+	# write when the (outermost) transaction ends. After that all "ok" replies
+	# are collected and checked. Reads inside a transaction first send the
+	# queued writes. So a transaction containing setfrequency (which reads
+	# the mode) is only one exchange with the device if the cache is enabled.
+	# usage:
+	#	with awg.transaction():
+	#		awg.setwaveform(1,"sine")
+	#		awg.setamplitude(1,5)
+	#		awg.setfrequency(1,1000)
+
+	@contextlib.contextmanager
+	def transaction(self):
+		if self.__tx.depth == 0:
+			self.__tx.queue=[]
+		# end if
+		self.__tx.depth += 1
+
+		try:
+			yield self
+		except BaseException:
+			self.__tx.depth -= 1
+			if self.__tx.depth == 0:
+				# drop queued writes, cached values of these writes are not valid
+				self.__tx.queue=None
+				self.cache_invalidate()
+			# end if
+			raise
+		# end try
+
+		self.__tx.depth -= 1
+		if self.__tx.depth == 0:
+			try:
+				self.__txflush()
+			finally:
+				self.__tx.queue=None
+			# end try
+		# end if
+	# end transaction
+
+	#######################
+	# Part 15: tracing
+
+	# A tracer records the duration of every command send to the device
+	# (reads, writes and transactions, not the ones answered by the cache).
+	# It must have a method add(name,category,start,end,args=None), with
+	# start and end as values of time.perf_counter() (like sweeptrace.Tracer)
+
+	# set the tracer (None to disable tracing)
+	def settracer(self,tracer):
+		self.__tracer=tracer
+	# end set tracer
+
+
+	# Part 16: connection
+
+	# close the serial port (and stop the I/O worker)
+	def close(self):
+		if self.__worker != None:
+			# the worker stops after all queued commands
+			self.__requests.put((jds6600.PRIORITY_LOW+1,next(self.__requestcount),None))
+			self.__worker.join()
+			self.__worker=None
+		# end if
+
+		if self.ser.is_open == True:
+			self.ser.close()
+	# end close
+
+
+	# Part 17: thread-safe mode
+
+	# With threadsafe=True in the constructor, all exchanges with the device
+	# (one command and its replies, or all commands of a transaction) are done
+	# by a single I/O worker thread, so commands of several threads never
+	# interleave on the serial line. The waiting exchanges are done in the
+	# order of their priority (in order of arrival for the same priority),
+	# so e.g. the writes of a sweep are not delayed behind the polling of
+	# measure_getall() by a monitoring thread:
+	#	with awg.priority(jds6600.PRIORITY_LOW):
+	#		awg.measure_getall()
+	# Every thread has its own transactions.
+	# Without threadsafe, the object must only be used by one thread at a time.
+
+	# context manager setting the priority of the commands of the calling thread
+	@contextlib.contextmanager
+	def priority(self,priority):
+		if priority not in (jds6600.PRIORITY_HIGH,jds6600.PRIORITY_NORMAL,jds6600.PRIORITY_LOW): raise ValueError(priority)
+
+		old=self.__priority.priority
+		self.__priority.priority=priority
+		try:
+			yield self
+		finally:
+			self.__priority.priority=old
+		# end try
+	# end priority
+
+
+	# is the thread-safe mode enabled?
+	def isthreadsafe(self):
+		return self.__worker != None
+	# end is thread-safe
+
+
+	# run an exchange with the device: by the I/O worker in thread-safe mode,
+	# directly otherwise
+	def __run(self,function,*args):
+		# without retries, the exchange is called directly
+		if (self.__retries == 0) and (self.__worker == None):
+			return function(*args)
+		# end if
+		if (self.__worker == None) or (threading.current_thread() is self.__worker):
+			return self.__attempt(function,args)
+		# end if
+
+		request=[self.__attempt,(function,args),threading.Event(),None,None]
+		self.__requests.put((self.__priority.priority,next(self.__requestcount),request))
+		request[2].wait()
+
+		if request[4] != None:
+			raise request[4]
+		# end if
+		return request[3]
+	# end run
+
+
+	# the I/O worker thread, runs the requests until the stop request (None)
+	def __ioworker(self):
+		while True:
+			(priority,count,request)=self.__requests.get()
+			if request == None: return
+
+			(function,args,done)=request[:3]
+			try:
+				request[3]=function(*args)
+			except BaseException as e:
+				request[4]=e
+			finally:
+				done.set()
+			# end try
+		# end while
+	# end ioworker
+
+
+	# Part 18: retries
+
+	# With retries > 0 in the constructor, an exchange with the device (a read,
+	# a write or all writes of a transaction) which fails because of a garbled
+	# or missing reply (UnexpectedReplyError, FormatError, UnexpectedValueError)
+	# or an error of the serial port (e.g. when the USB adapter was
+	# re-enumerated) is repeated up to retries times. Before every repetition
+	# it is waited (backoff, doubled for every further repetition), the input
+	# buffer is emptied so late replies do not mix up the next exchange, and
+	# after a port error the port is opened again.
+	# All exchanges are reads or writes of values, so repeating them is safe.
+
+	# errors after which an exchange is repeated
+	# (serial.SerialException is an OSError)
+	__retryerrors=(UnexpectedReplyError,FormatError,UnexpectedValueError,OSError)
+
+	# number of repeated exchanges and of reopened ports since the object was created
+	def getretries(self):
+		return (self.__retrycount,self.__reconnectcount)
+	# end get retries
+
+	# change the number of repetitions (and the backoff) given in the constructor
+	def setretries(self,retries,backoff=None):
+		if type(retries) != int: raise TypeError(retries)
+		if retries < 0: raise ValueError(retries)
+
+		self.__retries=retries
+		if backoff != None:
+			self.__backoff=backoff
+		# end if
+	# end set retries
+
+
+	# run an exchange, repeat it after errors of the serial line
+	def __attempt(self,function,args):
+		attempt=0
+		while True:
+			try:
+				return function(*args)
+			except jds6600.__retryerrors as e:
+				if attempt >= self.__retries: raise
+
+				attempt += 1
+				self.__retrycount += 1
+				if self.__tracer != None:
+					tstart=time.perf_counter()
+					self.__tracer.add("retry","awg",tstart,tstart,{"error": repr(e)})
+				# end if
+
+				time.sleep(self.__backoff*2**(attempt-1))
+				self.__resync(isinstance(e,OSError))
+			# end try
+		# end while
+	# end attempt
+
+
+	# empty the input buffer (and open the port again if reopen)
+	def __resync(self,reopen):
+		self.__rxbuffer=b""
+		try:
+			if (reopen == True) or (self.ser.is_open == False):
+				# the device may have been reset or changed while the port was gone
+				self.cache_invalidate()
+				self.ser.close()
+				self.ser.open()
+				self.__reconnectcount += 1
+			# end if
+			self.ser.reset_input_buffer()
+		except OSError:
+			# the port is not back yet, the next attempt fails again
+			pass
+		# end try
+	# end resync
+
 	##################################
 
 # end class jds6600
+
+
+
+######################
+# jds6600pool class  #
+######################
+
+class jds6600pool:
+	'registry of jds6600 connections, every port is opened only once'
+
+	# The pool keeps one jds6600 object per serial port, so the ports are
+	# opened once and can be reused for many sweeps (e.g. several
+	# generators driven by one process, one bench station per thread).
+	# Different generators can be used from different threads at the same
+	# time. To use the same generator from more than one thread, use
+	# acquire(), which gives exclusive access to the generator, or open the
+	# generators in thread-safe mode.
+
+	# cache, threadsafe, retries, backoff, timeout and arbtimeout are passed
+	# to the jds6600 objects
+	def __init__(self,cache=False,threadsafe=False,retries=0,backoff=0.05,timeout=1.0,arbtimeout=1.0):
+		if type(cache) != bool: raise TypeError(cache)
+		if type(threadsafe) != bool: raise TypeError(threadsafe)
+		if type(retries) != int: raise TypeError(retries)
+		if retries < 0: raise ValueError(retries)
+
+		self.__cachedefault=cache
+		self.__threadsafe=threadsafe
+		self.__options={"retries": retries, "backoff": backoff, "timeout": timeout, "arbtimeout": arbtimeout}
+		# port -> (jds6600 object, lock for exclusive use)
+		self.__devices={}
+		self.__lock=threading.Lock()
+	# end constructor
+
+
+	# get the jds6600 object of a port (opened at the first call)
+	# port is the name of the serial port, or a serial.Serial like object
+	def get(self,port):
+		return self.__getdevice(port)[0]
+	# end get
+
+
+	# context manager giving exclusive use of the generator on port
+	# (other threads calling acquire for the same port wait)
+	@contextlib.contextmanager
+	def acquire(self,port):
+		(awg,lock)=self.__getdevice(port)
+		with lock:
+			yield awg
+		# end with
+	# end acquire
+
+
+	def __getdevice(self,port):
+		key=port if type(port) == str else id(port)
+
+		with self.__lock:
+			if key not in self.__devices:
+				self.__devices[key]=(jds6600(port,cache=self.__cachedefault,threadsafe=self.__threadsafe,**self.__options),threading.RLock())
+			# end if
+			return self.__devices[key]
+		# end with
+	# end getdevice
+
+
+	# list of the names of the open ports
+	def ports(self):
+		with self.__lock:
+			return [awg.ser.port for (awg,lock) in self.__devices.values()]
+		# end with
+	# end ports
+
+
+	# close the port and remove it from the pool
+	def close(self,port):
+		key=port if type(port) == str else id(port)
+
+		with self.__lock:
+			(awg,lock)=self.__devices.pop(key)
+		# end with
+
+		with lock:
+			awg.close()
+		# end with
+	# end close
+
+
+	# close all ports
+	def closeall(self):
+		with self.__lock:
+			devices=list(self.__devices.values())
+			self.__devices.clear()
+		# end with
+
+		for (awg,lock) in devices:
+			with lock:
+				awg.close()
+			# end with
+		# end for
+	# end closeall
+
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*exc):
+		self.closeall()
+
+# end class jds6600pool
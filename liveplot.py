@@ -0,0 +1,160 @@
+# liveplot.py
+# Shows the amplitude (and phase) of a running sweep, in a separate process so drawing never slows down the measurement
+
+# Jan Böhmer (c) 2019
+# published under MIT license. See file "LICENSE" for full license text
+
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+
+
+class LivePlot:
+    """
+    A window with the amplitude (and phase) diagram of a running sweep, which is updated while the points arrive.
+
+    The window is drawn by a separate Python process running this file (matplotlib is only imported there), add() only
+    writes the point to its input pipe and returns immediately. The plot process redraws at most every interval seconds,
+    and only the curves are redrawn (blitting) unless the axis limits have to be changed.
+    """
+
+    def __init__(self, min_freq, max_freq, linear=False, phase=False, interval=0.1):
+        settings = json.dumps([min_freq, max_freq, linear, phase, interval])
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), settings], stdin=subprocess.PIPE,
+                                        universal_newlines=True)
+        self.closed = False
+
+    def add(self, freq, volt, phase=None):
+        """Adds a measured point (volt and phase may be None if they were not measured)."""
+        try:
+            self.process.stdin.write("%r %r %r\n" % (float(freq), _float(volt), _float(phase)))
+            self.process.stdin.flush()
+        except OSError:
+            # The window was closed
+            pass
+
+    def close(self):
+        """Closes the window, after the points added so far were drawn. Can be called more than once."""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=2)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _float(value):
+    """Converts a measured value to float, None becomes NaN."""
+    return float("nan") if value is None else float(value)
+
+
+def _read(file, points):
+    """Reads the points written by LivePlot.add() from file into the queue points, None marks the end."""
+    for line in file:
+        points.put(tuple(float(value) for value in line.split()))
+    points.put(None)
+
+
+def _run(points, min_freq, max_freq, linear, phase, interval):
+    """Draws the points from the queue points until None is received or the window is closed."""
+    import numpy as np
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(2 if phase else 1, 1, sharex=True, squeeze=False)
+    axes = axes[:, 0]
+    fig.canvas.manager.set_window_title("Bode plot (running)")
+
+    axes[0].set_title("Amplitude diagram")
+    axes[0].set_ylabel("Voltage Peak-Peak [V]")
+    if phase:
+        axes[1].set_title("Phase diagram")
+        axes[1].set_ylabel("Phase [°]")
+        axes[1].set_ylim(-180, 180)
+    axes[-1].set_xlabel("Frequency [Hz]")
+    axes[0].set_xlim(min_freq, max_freq)
+    if not linear:
+        axes[0].set_xscale("log")
+
+    # The curves are animated, so they are not part of the background which is restored before they are drawn
+    lines = [ax.plot([], [], ".-", animated=True)[0] for ax in axes]
+    background = [None]
+
+    def draw_lines():
+        fig.canvas.restore_region(background[0])
+        for ax, line in zip(axes, lines):
+            ax.draw_artist(line)
+        fig.canvas.blit(fig.bbox)
+
+    def on_draw(event):
+        # A full redraw (e.g. after resizing the window) invalidates the background
+        background[0] = fig.canvas.copy_from_bbox(fig.bbox)
+        for ax, line in zip(axes, lines):
+            ax.draw_artist(line)
+
+    fig.canvas.mpl_connect("draw_event", on_draw)
+    plt.show(block=False)
+    fig.canvas.draw()
+
+    freqs = []
+    values = [[] for _ in axes]
+    scaled = False
+    done = False
+    while not done and plt.fignum_exists(fig.number):
+        # Take all points which arrived since the last update
+        count = len(freqs)
+        try:
+            while True:
+                point = points.get_nowait()
+                if point is None:
+                    done = True
+                    break
+                freqs.append(point[0])
+                for n in range(len(axes)):
+                    values[n].append(point[n + 1])
+        except queue.Empty:
+            pass
+
+        if len(freqs) > count:
+            # In adaptive mode the points do not arrive in order of frequency
+            order = np.argsort(freqs)
+            redraw = False
+            for ax, line, data in zip(axes, lines, values):
+                data = np.array(data)[order]
+                line.set_data(np.array(freqs)[order], data)
+
+                # Only the amplitude axis is scaled, if a point is outside of it the whole figure has to be drawn again
+                valid = data[np.isfinite(data)]
+                if ax is axes[0] and len(valid):
+                    low, high = ax.get_ylim()
+                    if not scaled or valid.min() < low or valid.max() > high:
+                        margin = 0.1 * (valid.max() - valid.min()) or 0.1 * abs(valid.max()) or 1
+                        ax.set_ylim(valid.min() - margin, valid.max() + margin)
+                        scaled = redraw = True
+
+            if redraw:
+                fig.canvas.draw()
+            else:
+                draw_lines()
+
+        # Handle the events of the window (without drawing the whole figure like plt.pause() would do)
+        fig.canvas.start_event_loop(interval)
+
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    # The plot process started by LivePlot: the settings are given as argument, the points are read from stdin
+    points = queue.Queue()
+    threading.Thread(target=_read, args=(sys.stdin, points), daemon=True).start()
+    _run(points, *json.loads(sys.argv[1]))
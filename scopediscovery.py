@@ -0,0 +1,84 @@
+# scopediscovery.py
+# Finds the DS1054Z in the network, the address is cached so the slow Zeroconf discovery is only needed once
+
+# Jan Böhmer (c) 2019
+# published under MIT license. See file "LICENSE" for full license text
+
+import json
+import os
+import socket
+
+# The file in which the address and identity of the last found oscilloscope are stored
+CACHE_FILE = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "bode", "scope.json")
+
+# The port of the raw SCPI socket of the Rigol oscilloscopes
+SCPI_PORT = 5555
+
+
+def probe(ip, timeout=0.5):
+    """
+    Checks if a Rigol oscilloscope answers on ip, by sending *IDN? to its SCPI socket.
+    Returns the identity string, or None if there is no (valid) answer within timeout seconds.
+    """
+    try:
+        with socket.create_connection((ip, SCPI_PORT), timeout=timeout) as connection:
+            connection.settimeout(timeout)
+            connection.sendall(b"*IDN?\n")
+            reply = b""
+            while not reply.endswith(b"\n"):
+                data = connection.recv(256)
+                if not data:
+                    break
+                reply += data
+    except OSError:
+        return None
+
+    idn = reply.decode("ascii", "replace").strip()
+    return idn if idn.startswith("RIGOL TECHNOLOGIES,DS1") else None
+
+
+def load_cache(cache_file=CACHE_FILE):
+    """Returns the cached oscilloscope (dict with ip and idn) or None."""
+    try:
+        with open(cache_file) as file:
+            cached = json.load(file)
+        return cached if cached.get("ip") else None
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def save_cache(ip, idn, cache_file=CACHE_FILE):
+    """Stores the address and identity of the oscilloscope. Errors are ignored, the cache is only an optimization."""
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file + ".tmp", "w") as file:
+            json.dump({"ip": ip, "idn": idn}, file)
+        os.replace(cache_file + ".tmp", cache_file)
+    except OSError:
+        pass
+
+
+def find_scope(use_cache=True, cache_file=CACHE_FILE, timeout=0.5):
+    """
+    Returns the IP address and the identity string (None if unknown) of a DS1000Z oscilloscope in the network,
+    or (None, None) if none was found.
+
+    If use_cache is set, the oscilloscope found the last time is used, if it still answers with the same identity
+    (a quick check of the SCPI socket). Only if not, the (slow) Zeroconf discovery is done and its result is cached.
+    """
+    if use_cache:
+        cached = load_cache(cache_file)
+        if cached:
+            idn = probe(cached["ip"], timeout)
+            if idn and (idn == cached.get("idn") or not cached.get("idn")):
+                return cached["ip"], idn
+
+    import ds1054z.discovery
+    results = ds1054z.discovery.discover_devices()
+    if not results:
+        return None, None
+
+    ip = results[0]['ip']
+    idn = probe(ip, timeout)
+    save_cache(ip, idn, cache_file)
+    return ip, idn
@@ -0,0 +1,357 @@
+# simulator.py
+# Simulated JDS6600 and DS1054Z, to run bode.py without hardware
+
+# Jan Böhmer (c) 2019
+# published under MIT license. See file "LICENSE" for full license text
+
+import time
+
+import numpy as np
+
+
+def rc_lowpass(R=1e3, C=100e-9):
+    """Returns the transfer function of a RC low pass (default corner frequency 1.6 kHz)."""
+    return lambda f: 1 / (1 + 2j * np.pi * f * R * C)
+
+
+def rl_highpass(R=100, L=10e-3):
+    """Returns the transfer function of a RL high pass (default corner frequency 1.6 kHz)."""
+    return lambda f: 2j * np.pi * f * L / (R + 2j * np.pi * f * L)
+
+
+def lc_parallel(R=1e3, L=1e-3, C=1e-6, R_loss=10e3):
+    """
+    Returns the transfer function of a LC parallel resonance circuit (with loss resistance R_loss),
+    fed through the series resistor R (default resonance frequency 5 kHz).
+    """
+    def transfer(f):
+        w = 2 * np.pi * np.asarray(f, dtype=float)
+        Z = 1 / (1 / (1j * w * L) + 1j * w * C + 1 / R_loss)
+        return Z / (Z + R)
+    return transfer
+
+
+# The DUTs which can be selected by name
+DUTS = {
+    "rc": rc_lowpass,
+    "rl": rl_highpass,
+    "lc": lc_parallel,
+}
+
+
+class SimulatedJDS6600:
+    """
+    A serial.Serial like object, which answers the line protocol of a JDS6600 (:rNN=n., :wNN=value., :bNN=0., :aNN=values.).
+    It can be passed to the jds6600 constructor instead of a port name.
+
+    latency is the turnaround time in seconds of every write (like the latency timer of an USB-serial adapter),
+    in addition the transfer time of all bytes at 115200 baud is simulated if simulate_baudrate is set.
+    """
+
+    BAUDRATE = 115200
+
+    # mode register: the mode id is written, but the position in this list shifted by 3 bits is read
+    MODE_READ = {0: 0, 1: 2, 2: 4, 4: 8, 5: 9, 6: 10, 7: 11, 8: 12, 9: 13}
+
+    def __init__(self, latency=0.0, simulate_baudrate=False, max_freq=60):
+        self.latency = latency
+        self.simulate_baudrate = simulate_baudrate
+        self.is_open = True
+        self.port = "simulated"
+        self.timeout = 1
+
+        self.registers = {reg: "0" for reg in range(100)}
+        self.registers.update({
+            0: str(max_freq),
+            1: "1234567890",
+            20: "1,1",
+            23: "100000,0",
+            24: "100000,0",
+            25: "5000",
+            26: "5000",
+            27: "1000",
+            28: "1000",
+            29: "500",
+            30: "500",
+            32: "0,0,0,0",
+            42: "100",
+        })
+        self.waves = {n: [2048] * 2048 for n in range(1, 61)}
+        # start and end time of the last sweep (end is None while it is running)
+        self.sweep_started = None
+        self.sweep_stopped = None
+
+        self._buffer = bytearray()
+        self.transactions = 0
+        self.io_time = 0.0
+
+    # serial.Serial interface
+
+    @property
+    def in_waiting(self):
+        return len(self._buffer)
+
+    def write(self, data):
+        replies = bytearray()
+        for line in bytes(data).split(b"\n"):
+            if line:
+                replies += self._process(line.decode().rstrip())
+
+        delay = self.latency
+        if self.simulate_baudrate:
+            delay += (len(data) + len(replies)) * 10 / self.BAUDRATE
+        if delay > 0:
+            time.sleep(delay)
+        self.io_time += delay
+        self.transactions += 1
+
+        self._buffer += replies
+        return len(data)
+
+    def readline(self):
+        end = self._buffer.find(b"\n")
+        if end < 0:
+            # Like a timeout: return what is there
+            end = len(self._buffer) - 1
+        line = bytes(self._buffer[:end + 1])
+        del self._buffer[:end + 1]
+        return line
+
+    def read(self, size=1):
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def reset_input_buffer(self):
+        self._buffer.clear()
+
+    def flush(self):
+        pass
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    # device simulation
+
+    def _process(self, line):
+        """Processes one command line and returns the reply."""
+        cmd, reg, value = line[1], int(line[2:4]), line[5:-1]
+
+        if cmd == "r":
+            reply = ""
+            for r in range(reg, reg + int(value) + 1):
+                val = self.registers[r]
+                if r == 33:
+                    val = str(self.MODE_READ.get(int(val), 0) << 3)
+                reply += ":r%02d=%s.\r\n" % (r, val)
+            return reply.encode()
+
+        if cmd == "w":
+            self.registers[reg] = value
+            if reg == 32:
+                # action register: "0,1,0,0" starts a sweep, everything else stops it
+                if value == "0,1,0,0":
+                    self.sweep_started = time.monotonic()
+                    self.sweep_stopped = None
+                elif self.sweep_started is not None and self.sweep_stopped is None:
+                    self.sweep_stopped = time.monotonic()
+            return b":ok\r\n"
+
+        if cmd == "b":
+            return (":b%02d=%s,.\r\n" % (reg, ",".join(str(v) for v in self.waves[reg]))).encode()
+
+        if cmd == "a":
+            self.waves[reg] = [int(v) for v in value.split(",")]
+            return b":ok\r\n"
+
+        return b":error\r\n"
+
+    def frequency(self, channel=1):
+        """The current (not sweeping) frequency of the channel in Hz."""
+        f, multiplier = self.registers[22 + channel].split(",")
+        return int(f) / 100 * (1, 1, 1, 1/1000, 1/1000000)[int(multiplier)]
+
+    def amplitude(self, channel=1):
+        """The current peak-peak voltage of the channel."""
+        return int(self.registers[24 + channel]) / 1000
+
+    def sweep_phase(self, t):
+        """
+        Returns the phase (in radian) and the instantaneous frequency of channel 1 at the times t (from time.monotonic()).
+        Outside of the last sweep, the channel has its normal frequency.
+        """
+        t = np.asarray(t, dtype=float)
+        f_normal = self.frequency(1)
+        if self.sweep_started is None:
+            return 2 * np.pi * f_normal * t, np.full(t.shape, f_normal)
+
+        f0 = int(self.registers[40]) / 100
+        f1 = int(self.registers[41]) / 100
+        T = int(self.registers[42]) / 10
+        logarithmic = self.registers[44] == "1"
+
+        # The sweep is repeated, before it started the start frequency is output
+        tau = np.where(t < self.sweep_started, 0, (t - self.sweep_started) % T)
+        if logarithmic:
+            k = np.log(f1 / f0) / T
+            f = f0 * np.exp(k * tau)
+            phase = 2 * np.pi * f0 * (np.exp(k * tau) - 1) / k
+        else:
+            f = f0 + (f1 - f0) * tau / T
+            phase = 2 * np.pi * (f0 * tau + (f1 - f0) * tau ** 2 / (2 * T))
+        phase = np.where(t < self.sweep_started, 2 * np.pi * f0 * (t - self.sweep_started), phase)
+
+        if self.sweep_stopped is not None:
+            after = t >= self.sweep_stopped
+            phase = np.where(after, 2 * np.pi * f_normal * t, phase)
+            f = np.where(after, f_normal, f)
+        return phase, f
+
+
+class SimulatedDS1054Z:
+    """
+    Replacement for ds1054z.DS1054Z, which measures a simulated DUT driven by channel 1 of a SimulatedJDS6600.
+    CH1 of the scope is connected to the DUT input, CH2 to the DUT output.
+
+    dut is the name of one of the DUTS (rc, rl, lc) or a function returning the complex transfer function for a frequency.
+    latency is the time in seconds every SCPI command takes, noise the RMS voltage of the noise added to all signals.
+    """
+
+    MIN_TIMEBASE_SCALE = 5E-9
+    MAX_TIMEBASE_SCALE = 50E0
+    SAMPLES_ON_DISPLAY = 1200
+
+    def __init__(self, awg, dut="rc", latency=0.0, noise=0.001, memory_depth=1200000, seed=0):
+        self.awg = awg
+        self.transfer = DUTS[dut]() if isinstance(dut, str) else dut
+        self.latency = latency
+        self.noise = noise
+        self.memory_depth = memory_depth
+        self.random = np.random.default_rng(seed)
+
+        self.idn = "RIGOL TECHNOLOGIES,DS1054Z,SIMULATED,00.04.04"
+        self.possible_timebase_scale_values = [m * 10 ** e for e in range(-9, 2) for m in (1, 2, 5) if self.MIN_TIMEBASE_SCALE <= m * 10 ** e <= self.MAX_TIMEBASE_SCALE]
+        self.possible_channel_scale_values = [m * 10 ** e for e in range(-3, 2) for m in (1, 2, 5) if m * 10 ** e <= 10]
+
+        self.scales = {1: 1.0, 2: 1.0}
+        self.offsets = {1: 0.0, 2: 0.0}
+        self._timebase = 1e-3
+        self.stopped_at = None
+        self.preamble = {'xinc': self._timebase * 12 / self.SAMPLES_ON_DISPLAY, 'xorig': -6 * self._timebase}
+
+        self.commands = 0
+        self.io_time = 0.0
+
+    def _command(self):
+        """Simulates the time of one SCPI command."""
+        if self.latency > 0:
+            time.sleep(self.latency)
+        self.io_time += self.latency
+        self.commands += 1
+
+    @property
+    def timebase_scale(self):
+        self._command()
+        return self._timebase
+
+    @timebase_scale.setter
+    def timebase_scale(self, new_timebase):
+        self._command()
+        self._timebase = min(self.possible_timebase_scale_values, key=lambda x: abs(x - new_timebase))
+
+    def run(self):
+        self._command()
+        self.stopped_at = None
+
+    def stop(self):
+        self._command()
+        self.stopped_at = time.monotonic()
+
+    def single(self):
+        self.run()
+
+    def close(self):
+        pass
+
+    def get_probe_ratio(self, channel):
+        self._command()
+        return 1.0
+
+    def set_channel_offset(self, channel, volts):
+        self._command()
+        self.offsets[channel] = volts
+
+    def get_channel_scale(self, channel):
+        self._command()
+        return self.scales[channel]
+
+    def set_channel_scale(self, channel, volts, use_closest_match=False):
+        self._command()
+        if use_closest_match:
+            volts = min(self.possible_channel_scale_values, key=lambda x: abs(x - volts))
+        self.scales[channel] = volts
+
+    def _signal(self, channel, phase, f):
+        """The clipped and quantized voltage of a channel, for the phase and frequency of the generator."""
+        amplitude = self.awg.amplitude(1) / 2
+        if channel == 2:
+            H = self.transfer(f)
+            amplitude = amplitude * np.abs(H)
+            phase = phase + np.angle(H)
+        signal = amplitude * np.cos(phase) + self.noise * self.random.standard_normal(np.shape(phase))
+
+        # The ADC covers 10 divs with 8 bit
+        scale = self.scales[channel]
+        signal = np.clip(signal - self.offsets[channel], -5 * scale, 5 * scale)
+        return np.round(signal / scale * 25) * scale / 25
+
+    def get_channel_measurement(self, channel, item, type="CURRent"):
+        self._command()
+        f = self.awg.frequency(1)
+        amplitude = self.awg.amplitude(1)
+        H = self.transfer(f)
+
+        if item == "vpp":
+            if channel == 2:
+                amplitude = amplitude * abs(H)
+            # A signal which is much bigger than the screen can not be measured correctly
+            scale = self.scales[channel]
+            vpp = min(amplitude + 2 * self.noise * abs(self.random.standard_normal()), 8.2 * scale)
+            # Signals smaller than one step of the ADC can not be measured
+            return vpp if vpp > scale / 25 else None
+
+        if item == "rphase":
+            # Phase of CH2 relative to CH1, positive when CH2 lags
+            noise = np.degrees(self.noise / max(amplitude * abs(H), 1e-12)) * self.random.standard_normal()
+            return float(-np.degrees(np.angle(H)) + noise)
+
+        return None
+
+    def get_waveform_samples(self, channel, mode="NORMal"):
+        self._command()
+        if isinstance(channel, str):
+            channel = int(channel[-1])
+
+        if mode.upper().startswith("RAW"):
+            # The whole memory until the acquisition was stopped
+            self.stopped_at = self.stopped_at or time.monotonic()
+            points = self.memory_depth
+            xinc = self._timebase * 12 / points
+            phase, f = self.awg.sweep_phase(self.stopped_at - 12 * self._timebase + xinc * np.arange(points))
+        else:
+            # The screen, triggered on the rising edge of CH1 in the middle
+            points = self.SAMPLES_ON_DISPLAY
+            xinc = self._timebase * 12 / points
+            f = self.awg.frequency(1)
+            phase = 2 * np.pi * f * (-6 * self._timebase + xinc * np.arange(points)) - np.pi / 2
+
+        self.preamble = {'xinc': xinc, 'xorig': -6 * self._timebase}
+        return list(self._signal(channel, phase, f))
+
+    @property
+    def waveform_preamble_dict(self):
+        self._command()
+        return dict(self.preamble)
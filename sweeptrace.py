@@ -0,0 +1,97 @@
+# sweeptrace.py
+# Timing instrumentation for sweeps, exported as Chrome trace (Perfetto) JSON
+
+# Jan Böhmer (c) 2019
+# published under MIT license. See file "LICENSE" for full license text
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Returned by Tracer.span() when tracing is disabled
+_NO_SPAN = contextlib.nullcontext()
+
+
+class Tracer:
+    """
+    Records the start and end times (time.perf_counter(), which is monotonic) of named phases ("spans") of a sweep.
+
+    Spans are recorded with the span() context manager, or with add() if the times were measured already
+    (the jds6600 class does this for every command, see jds6600.settracer()).
+    When the tracer is disabled, span() returns a shared context manager which does nothing, so the
+    instrumentation can stay in the code with negligible overhead.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.events = []
+
+    def add(self, name, category, start, end, args=None):
+        """Records a span, start and end are values of time.perf_counter()."""
+        if self.enabled:
+            # list.append is atomic, so spans can be recorded from several threads (e.g. with --pipeline)
+            self.events.append((name, category, start, end, threading.current_thread().name, args))
+
+    def span(self, name, category="sweep", **args):
+        """Returns a context manager, which records the time spent in it. args are stored with the span."""
+        if not self.enabled:
+            return _NO_SPAN
+        return self._span(name, category, args or None)
+
+    @contextlib.contextmanager
+    def _span(self, name, category, args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, category, start, time.perf_counter(), args)
+
+    def chrome_trace(self):
+        """
+        Returns the recorded spans in the Chrome trace event format (complete events with times in µs),
+        which can be opened with https://ui.perfetto.dev or chrome://tracing.
+        """
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for name, category, start, end, thread, args in self.events:
+            tid = threads.setdefault(thread, len(threads) + 1)
+            event = {"name": name, "cat": category, "ph": "X", "pid": pid, "tid": tid,
+                     "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6}
+            if args:
+                event["args"] = args
+            events.append(event)
+
+        # Show the names of the threads instead of their numbers
+        for thread, tid in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}})
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, filename):
+        """Writes the recorded spans as Chrome trace JSON to the given file."""
+        with open(filename, "w") as file:
+            json.dump(self.chrome_trace(), file)
+
+    def summary(self):
+        """
+        Returns a list of (category, name, count, total time, mean time, maximum time) for every kind of span
+        (times in seconds), sorted by the total time.
+        """
+        stats = {}
+        for name, category, start, end, thread, args in self.events:
+            count, total, maximum = stats.get((category, name), (0, 0.0, 0.0))
+            stats[(category, name)] = (count + 1, total + end - start, max(maximum, end - start))
+
+        rows = [(category, name, count, total, total / count, maximum) for (category, name), (count, total, maximum) in stats.items()]
+        return sorted(rows, key=lambda row: -row[3])
+
+    def format_summary(self):
+        """Returns the summary() as a text table."""
+        lines = ["%-8s %-24s %8s %10s %10s %10s" % ("Category", "Span", "Count", "Total [s]", "Mean [ms]", "Max [ms]")]
+        for category, name, count, total, mean, maximum in self.summary():
+            lines.append("%-8s %-24s %8d %10.3f %10.3f %10.3f" % (category, name, count, total, mean * 1e3, maximum * 1e3))
+        return "\n".join(lines)
@@ -0,0 +1,254 @@
+# sweepwriter.py
+# Writers which save the points of a sweep while it is running (CSV, NPZ, HDF5, Parquet)
+
+# Jan Böhmer (c) 2019
+# published under MIT license. See file "LICENSE" for full license text
+
+import importlib.util
+import json
+import os
+import time
+
+import numpy as np
+
+# The columns stored in the binary formats (the CSV file only contains frequency, amplitude, phase and settling time)
+COLUMNS = ("frequency", "amplitude", "phase", "settle_time", "timestamp", "scale", "timebase")
+
+
+def _float(value):
+    """Converts a measured value to float, None becomes NaN."""
+    return float("nan") if value is None else float(value)
+
+
+class SweepWriter:
+    """
+    Base class of the writers. Every point is written with write_point() as soon as it is measured,
+    so nothing is lost if the program crashes or is interrupted, and no data is kept in memory.
+    If fsync is set, the data is also forced to disk after every point.
+
+    metadata is a dict with the settings of the sweep (like generator voltage or scope settings),
+    which is stored in the binary formats. The start time is added automatically.
+    """
+
+    def __init__(self, filename, phase=False, settle=False, metadata=None, fsync=False):
+        self.filename = filename
+        self.phase = phase
+        self.settle = settle
+        self.fsync = fsync
+        self.metadata = dict(metadata or {})
+        self.metadata.setdefault("start_time", time.strftime("%Y-%m-%dT%H:%M:%S"))
+        self.count = 0
+        self.closed = False
+
+    def write_point(self, freq, volt, phase=None, settle_time=None, scale=None, timebase=None, timestamp=None):
+        """
+        Writes one measured point. volt is the amplitude (None if it could not be measured), scale and timebase
+        are the settings of the scope used for the measurement. timestamp is the time of the measurement (time.time()),
+        the current time is used if it is None.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        self._write((float(freq), _float(volt), _float(phase), _float(settle_time), timestamp, _float(scale), _float(timebase)))
+        self.count += 1
+
+    def close(self):
+        """Finishes the file. Can be called more than once."""
+        if not self.closed:
+            self.closed = True
+            self._close()
+
+    def _sync(self, file):
+        file.flush()
+        if self.fsync:
+            os.fsync(file.fileno())
+
+    def _write(self, row):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CSVWriter(SweepWriter):
+    """Writes the semicolon separated CSV file of bode.py."""
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.file = open(filename, "w")
+
+        header = "Frequency in Hz; Amplitude in V"
+        if self.phase:
+            header += "; Phase in Degree"
+        if self.settle:
+            header += "; Settling time in s"
+        self.file.write(header + "\n")
+        self._sync(self.file)
+
+    def _write(self, row):
+        # Like before, amplitudes of 0 are written as NaN
+        line = "%f;%f" % (row[0], row[1] or float("nan"))
+        if self.phase:
+            line += ";%f" % row[2]
+        if self.settle:
+            line += ";%f" % row[3]
+        self.file.write(line + " \n")
+        self._sync(self.file)
+
+    def _close(self):
+        self.file.close()
+
+
+class _BufferedWriter(SweepWriter):
+    """
+    Base of formats which can only be written at once (NPZ, Parquet): the points are appended as raw float64 rows
+    (one value per entry of COLUMNS) to the file FILENAME.part while the sweep runs, which is converted when the
+    writer is closed. After a crash the points can be recovered with np.fromfile(FILENAME.part).reshape(-1, 7).
+    """
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.partname = filename + ".part"
+        self.part = open(self.partname, "wb")
+
+    def _write(self, row):
+        self.part.write(np.array(row, dtype=np.float64).tobytes())
+        self._sync(self.part)
+
+    def _close(self):
+        self.part.close()
+        data = np.fromfile(self.partname, dtype=np.float64).reshape(-1, len(COLUMNS))
+        self._save(data)
+        os.remove(self.partname)
+
+    def _save(self, data):
+        raise NotImplementedError
+
+
+class NPZWriter(_BufferedWriter):
+    """Writes a numpy .npz file with one array per column and the metadata as JSON string (array "metadata")."""
+
+    def _save(self, data):
+        arrays = {name: data[:, n] for n, name in enumerate(COLUMNS)}
+        # Write to a temporary file first, so a complete file is never replaced by a broken one
+        with open(self.filename + ".tmp", "wb") as file:
+            np.savez(file, metadata=np.array(json.dumps(self.metadata)), **arrays)
+        os.replace(self.filename + ".tmp", self.filename)
+
+
+class ParquetWriter(_BufferedWriter):
+    """Writes an Apache Parquet file (needs pyarrow) with the metadata as JSON in the schema metadata (key "bode")."""
+
+    def __init__(self, filename, **kwargs):
+        # Check for pyarrow before the sweep is started (find_spec() raises ImportError if pyarrow itself is missing)
+        if importlib.util.find_spec("pyarrow.parquet") is None:
+            raise ImportError("No module named 'pyarrow.parquet'")
+        super().__init__(filename, **kwargs)
+
+    def _save(self, data):
+        import pyarrow
+        import pyarrow.parquet
+        table = pyarrow.table({name: data[:, n] for n, name in enumerate(COLUMNS)})
+        table = table.replace_schema_metadata({"bode": json.dumps(self.metadata)})
+        pyarrow.parquet.write_table(table, self.filename)
+
+
+class HDF5Writer(SweepWriter):
+    """
+    Writes a HDF5 file (needs h5py) with one extendable dataset per column, the metadata is stored in the attributes
+    of the file. Every point is flushed to the file directly.
+    """
+
+    def __init__(self, filename, **kwargs):
+        import h5py
+        super().__init__(filename, **kwargs)
+        self.file = h5py.File(filename, "w")
+        for key, value in self.metadata.items():
+            if value is not None:
+                self.file.attrs[key] = value
+        for name in COLUMNS:
+            self.file.create_dataset(name, shape=(0,), maxshape=(None,), dtype="f8", chunks=True)
+        self.file.flush()
+
+    def _write(self, row):
+        for name, value in zip(COLUMNS, row):
+            dataset = self.file[name]
+            dataset.resize((self.count + 1,))
+            dataset[self.count] = value
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.id.get_vfd_handle())
+
+    def _close(self):
+        self.file.close()
+
+
+# The writers for the file extensions
+WRITERS = {
+    ".csv": CSVWriter,
+    ".npz": NPZWriter,
+    ".h5": HDF5Writer,
+    ".hdf5": HDF5Writer,
+    ".parquet": ParquetWriter,
+}
+
+
+def open_writer(filename, **kwargs):
+    """
+    Returns a writer for the format given by the extension of filename (CSV for unknown extensions).
+    The keyword arguments are passed to the writer (see SweepWriter). Raises ImportError if the module
+    needed for the format (h5py, pyarrow) is not installed.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    return WRITERS.get(extension, CSVWriter)(filename, **kwargs)
+
+
+def save_checkpoint(filename, state):
+    """
+    Starts the checkpoint file filename with the state of a sweep (a dict which can be converted to JSON, usually
+    the settings and the points measured so far). The file is replaced atomically, so there is always a complete
+    checkpoint, even if the program is killed while saving.
+    """
+    with open(filename + ".tmp", "w") as file:
+        file.write(json.dumps(state) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(filename + ".tmp", filename)
+
+
+def append_checkpoint(filename, points, state=None):
+    """
+    Appends the new points (dicts) and the changed entries of the state to the checkpoint file filename,
+    as one line of JSON. Only the new data is written, so the time and memory needed do not grow with the sweep.
+    """
+    with open(filename, "a") as file:
+        file.write(json.dumps(dict(state or {}, points=points)) + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def load_checkpoint(filename):
+    """
+    Loads a checkpoint saved with save_checkpoint() and append_checkpoint(): the points of all lines are joined,
+    the other entries are taken from the last line containing them. A last line which was not written completely
+    (the program was killed while saving) is ignored.
+    """
+    with open(filename) as file:
+        lines = file.read().splitlines()
+
+    state = json.loads(lines[0])
+    state.setdefault("points", [])
+    for n, line in enumerate(lines[1:], 2):
+        try:
+            update = json.loads(line)
+        except ValueError:
+            if n == len(lines):
+                break
+            raise
+        state["points"] += update.pop("points", [])
+        state.update(update)
+    return state
@@ -0,0 +1,166 @@
+# test_bodeanalysis.py
+# Tests of the signal processing functions of bodeanalysis.py (run with pytest)
+
+# Jan Böhmer (c) 2019
+# published under MIT license. See file "LICENSE" for full license text
+
+import numpy as np
+import pytest
+
+import bodeanalysis
+
+
+def sweep_record(gain, phase, f_start=10, f_end=1000, sweep_time=1, start=0.1, rate=50000):
+    """Returns a scope record (t, ch1, ch2) of a logarithmic generator sweep through a DUT with constant gain and phase (degree)."""
+    t = np.arange(0, start + sweep_time + 0.1, 1 / rate)
+    inside = (t >= start) & (t <= start + sweep_time)
+    sweep = bodeanalysis.sweep_phase(np.clip(t - start, 0, sweep_time), f_start, f_end, sweep_time, True)
+    ch1 = np.where(inside, np.sin(sweep), 0)
+    ch2 = np.where(inside, gain * np.sin(sweep + np.radians(phase)), 0)
+    return t, ch1, ch2
+
+
+# generator sweeps
+
+@pytest.mark.parametrize("logarithmic", [True, False], ids=["logarithmic", "linear"])
+def test_sweep_time_of_inverts_sweep_frequency(logarithmic):
+    t = np.linspace(0, 2, 11)
+    freqs = bodeanalysis.sweep_frequency(t, 10, 1000, 2, logarithmic)
+    assert freqs[0] == pytest.approx(10) and freqs[-1] == pytest.approx(1000)
+    assert bodeanalysis.sweep_time_of(freqs, 10, 1000, 2, logarithmic) == pytest.approx(t)
+
+
+def test_find_sweep_start():
+    t, ch1, ch2 = sweep_record(0.5, -45)
+    assert bodeanalysis.find_sweep_start(t, ch1, 10, 1000, 1, True) == pytest.approx(0.1, abs=1e-4)
+
+
+def test_reconstruct_sweep():
+    t, ch1, ch2 = sweep_record(0.5, -45)
+    volts1, volts2, phases = bodeanalysis.reconstruct_sweep(t, ch1, ch2, [20, 100, 500], 10, 1000, 1, True)
+    assert volts1 == pytest.approx([2, 2, 2], rel=1e-3)
+    assert volts2 == pytest.approx([1, 1, 1], rel=1e-3)
+    assert phases == pytest.approx([-45, -45, -45], abs=0.1)
+
+
+def test_reconstruct_sweep_outside_record():
+    t, ch1, ch2 = sweep_record(0.5, -45)
+    volts1, volts2, phases = bodeanalysis.reconstruct_sweep(t, ch1, ch2, [100, 2000], 10, 1000, 1, True)
+    assert not np.isnan(volts2[0])
+    assert np.isnan(volts1[1]) and np.isnan(volts2[1]) and np.isnan(phases[1])
+
+
+def test_reconstruct_sweep_without_sweep():
+    t, ch1, ch2 = sweep_record(0.5, -45)
+    volts1, volts2, phases = bodeanalysis.reconstruct_sweep(t, np.zeros_like(t), ch2, [20, 100], 10, 1000, 1, True)
+    assert np.all(np.isnan(volts1)) and np.all(np.isnan(volts2)) and np.all(np.isnan(phases))
+
+
+# adaptive sweeps
+
+def lowpass(freqs, corner=1000):
+    return 1 / np.sqrt(1 + (np.asarray(freqs) / corner) ** 2)
+
+
+def test_refine_frequencies_flat():
+    freqs = np.logspace(1, 5, 9)
+    assert len(bodeanalysis.refine_frequencies(freqs, np.ones(9), np.zeros(9))) == 0
+
+
+def test_refine_frequencies_corner():
+    freqs = np.logspace(1, 5, 9)
+    new = bodeanalysis.refine_frequencies(freqs, lowpass(freqs))
+    assert len(new) > 0
+    # in the middle of measured intervals (in decades), around and above the corner
+    assert np.all(np.isin(np.round(np.log10(new), 6), np.round(np.log10(freqs[:-1]) + 0.25, 6)))
+    assert new.min() < 1000 < new.max()
+
+
+def test_refine_frequencies_limit():
+    freqs = np.logspace(1, 5, 9)
+    new = bodeanalysis.refine_frequencies(freqs, lowpass(freqs), limit=1)
+    # the interval with the strongest bend (the corner) is refined first
+    assert new == pytest.approx([10 ** 2.75])
+
+
+def test_refine_frequencies_min_spacing():
+    freqs = np.logspace(1, 5, 9)
+    assert len(bodeanalysis.refine_frequencies(freqs, lowpass(freqs), min_spacing=0.5)) == 0
+
+
+def test_refine_frequencies_phase():
+    freqs = np.logspace(1, 5, 9)
+    phases = np.zeros(9)
+    phases[4:] = -90
+    new = bodeanalysis.refine_frequencies(freqs, np.ones(9), phases)
+    # the step is between 10^2.5 and 10^3 Hz
+    assert np.any(np.isclose(new, 10 ** 2.75))
+
+
+def test_refine_frequencies_ignores_invalid():
+    freqs = np.logspace(1, 5, 9)
+    volts = np.ones(9)
+    volts[3] = np.nan
+    assert len(bodeanalysis.refine_frequencies(freqs, volts)) == 0
+
+
+# lock-in
+
+def cosine(t, freq, volts, phase, offset=0):
+    """A sine with the peak-peak voltage volts and the phase (degree) relative to t=0."""
+    return offset + volts / 2 * np.cos(2 * np.pi * freq * t + np.radians(phase))
+
+
+def test_lockin():
+    t = np.linspace(0, 0.01, 1200, endpoint=False)
+    z = bodeanalysis.lockin(t, cosine(t, 1000, 3, 30, offset=0.7), 1000)
+    assert abs(z) == pytest.approx(3, rel=1e-4)
+    assert np.degrees(np.angle(z)) == pytest.approx(30, abs=0.01)
+
+
+def test_lockin_ignores_nan():
+    t = np.linspace(0, 0.01, 1200, endpoint=False)
+    samples = cosine(t, 1000, 3, 30)
+    samples[:100] = np.nan
+    z = bodeanalysis.lockin(t, samples, 1000)
+    assert abs(z) == pytest.approx(3, rel=1e-2)
+    assert np.degrees(np.angle(z)) == pytest.approx(30, abs=0.1)
+
+
+def test_lockin_batch():
+    t = np.linspace(0, 0.01, 1200, endpoint=False)
+    z = bodeanalysis.lockin(t, np.vstack([cosine(t, 1000, 3, 30), cosine(t, 2000, 4, -60)]), [1000, 2000])
+    assert np.abs(z) == pytest.approx([3, 4], rel=1e-4)
+    assert np.degrees(np.angle(z)) == pytest.approx([30, -60], abs=0.01)
+
+
+def test_lockin_batch_own_times():
+    t = np.linspace(0, 0.01, 1200, endpoint=False)
+    times = np.vstack([t, 2 * t])
+    z = bodeanalysis.lockin(times, np.vstack([cosine(t, 1000, 3, 30), cosine(2 * t, 1000, 1, 0)]), [1000, 1000])
+    assert np.abs(z) == pytest.approx([3, 1], rel=1e-4)
+
+
+# autoranging
+
+def test_predict_amplitude_interpolates():
+    # -20 dB per decade
+    assert bodeanalysis.predict_amplitude([100, 1000], [1, 0.1], 300) == pytest.approx(10 ** -0.477, rel=1e-3)
+
+
+def test_predict_amplitude_extrapolates_nearest():
+    assert bodeanalysis.predict_amplitude([10, 100, 1000, 10000], [1, 1, 1, 0.1], 100000) == pytest.approx(0.01)
+
+
+def test_predict_amplitude_limits_slope():
+    # about 400 dB per decade is limited to max_slope (60 dB per decade)
+    assert bodeanalysis.predict_amplitude([100, 200], [1, 1e-6], 2000) == pytest.approx(1e-9)
+
+
+def test_predict_amplitude_single_point():
+    assert bodeanalysis.predict_amplitude([100], [0.5], 1000) == 0.5
+
+
+def test_predict_amplitude_ignores_invalid():
+    assert bodeanalysis.predict_amplitude([100, 200, 300], [None, np.nan, 0], 1000) is None
+    assert bodeanalysis.predict_amplitude([100, 200, 300], [None, 2, 0], 1000) == 2
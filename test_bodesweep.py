@@ -0,0 +1,96 @@
+# test_bodesweep.py
+# Tests of the BodeSweep library API against the simulated instruments (run with pytest)
+
+# Jan Böhmer (c) 2019
+# published under MIT license. See file "LICENSE" for full license text
+
+import time
+
+import numpy as np
+import pytest
+
+from bodesweep import BodeSweep, SweepPoint
+
+
+@pytest.fixture
+def bode():
+    with BodeSweep.simulate("rc", phase=True, log=None) as bode:
+        yield bode
+
+
+def test_measure(bode):
+    result = bode.measure(100, 100000, 5)
+    assert result.freqs == pytest.approx(np.logspace(2, 5, 5))
+    # RC lowpass: falling amplitude, phase between 0 and -90 degree
+    assert result.volts[0] == pytest.approx(5, rel=0.02)
+    assert np.all(np.diff(result.volts) < 0)
+    assert np.all((result.phases < 0) & (result.phases > -90))
+
+
+def test_sweep_yields_while_measuring(bode, monkeypatch):
+    measured = []
+    measure_point = bode.measure_point
+    monkeypatch.setattr(bode, "measure_point", lambda freq: measured.append(freq) or measure_point(freq))
+    points = bode.sweep(100, 10000, 3)
+    point = next(points)
+    assert isinstance(point, SweepPoint)
+    assert point.freq == 100 and point.scale == bode.current_scale
+    assert measured == [100]
+    assert len(list(points)) == 2
+
+
+def test_sweep_restored(bode, monkeypatch):
+    restored = list(bode.sweep(100, 10000, 5))[:3]
+    measured = []
+    measure_point = bode.measure_point
+    monkeypatch.setattr(bode, "measure_point", lambda freq: measured.append(freq) or measure_point(freq))
+    points = list(bode.sweep(100, 10000, 5, restored=restored))
+    # the points of the interrupted sweep are yielded again without being measured
+    assert points[:3] == restored
+    assert measured == pytest.approx([points[3].freq, points[4].freq])
+
+
+def test_sweep_adaptive(bode):
+    points = list(bode.sweep(100, 100000, 12, adaptive=True))
+    assert 5 < len(points) <= 12
+    assert len({point.freq for point in points}) == len(points)
+
+
+@pytest.mark.parametrize("args", [(0, 1000, 5), (1000, 100, 5), (100, 1000, 0), (100, 1e9, 5)],
+                         ids=["zero", "reversed", "no_points", "above_awg"])
+def test_sweep_invalid(bode, args):
+    with pytest.raises(ValueError):
+        list(bode.sweep(*args))
+
+
+def test_hw_sweep_refuses_manual_settings():
+    with BodeSweep.simulate("rc", manual_settings=True, log=None) as bode:
+        with pytest.raises(ValueError):
+            list(bode.sweep(100, 10000, 10, hw_sweep=True))
+
+
+@pytest.mark.parametrize("count, grid", [(100, 25), (12, 5), (3, 3)])
+def test_frequencies_adaptive_grid(count, grid):
+    freqs = BodeSweep.frequencies(100, 10000, count, adaptive=True)
+    assert len(freqs) == grid
+    assert freqs[0] == pytest.approx(100) and freqs[-1] == pytest.approx(10000)
+
+
+def test_settle_compares_after_timeout(monkeypatch):
+    with BodeSweep.simulate("rc", settle=True, settle_timeout=0.001, log=None) as bode:
+        readings = []
+        read_measurement = bode.read_measurement
+        monkeypatch.setattr(bode, "read_measurement", lambda freq: readings.append(freq) or read_measurement(freq))
+        bode.set_frequency(10000)
+        # the timeout is already over before the first measurement
+        bode.wait_and_read(10000, time.monotonic() - 1)
+        assert len(readings) == 2
+
+
+@pytest.mark.parametrize("lockin", [False, True], ids=["vpp", "lockin"])
+def test_normalize_recovers_from_missing_measurement(lockin):
+    # the first points start with a CH2 range much too large for the small output of the RC lowpass
+    with BodeSweep.simulate("rc", normalize=True, lockin=lockin, log=None) as bode:
+        points = list(bode.sweep(500000, 1000000, 5))
+    assert len(points) == 5
+    assert all(point.volt is not None and 0 < point.volt < 0.01 for point in points)
@@ -0,0 +1,370 @@
+# test_jds6600.py
+# Tests of the jds6600 protocol layer against the simulated generator (run with pytest)
+
+# Jan Böhmer (c) 2019
+# published under MIT license. See file "LICENSE" for full license text
+
+import time
+
+import numpy as np
+import pytest
+import serial
+
+from jds6600 import jds6600, FormatError, UnexpectedReplyError, UnexpectedValueError
+from simulator import SimulatedJDS6600
+
+
+@pytest.fixture
+def port():
+    return SimulatedJDS6600()
+
+
+@pytest.fixture
+def awg(port):
+    return jds6600(port, cache=True, backoff=0)
+
+
+def fail_writes(port, monkeypatch, error, count=1):
+    """Lets the next count writes to port fail: error is an exception to raise, or the reply (bytes) to send instead."""
+    write = port.write
+    failures = [count]
+
+    def failing_write(data):
+        if failures[0] <= 0:
+            return write(data)
+        failures[0] -= 1
+        if isinstance(error, bytes):
+            port._buffer += error
+            return len(data)
+        raise error
+
+    monkeypatch.setattr(port, "write", failing_write)
+
+
+class SlowPort(SimulatedJDS6600):
+    """Simulated generator whose replies seem to arrive while they are read, counting the reads and timeout changes."""
+
+    def __init__(self, delay=0):
+        self.timeout_changes = 0
+        super().__init__()
+        self.delay = delay
+        self.reads = 0
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+        self.timeout_changes += 1
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def read(self, size=1):
+        self.reads += 1
+        time.sleep(self.delay)
+        return super().read(size)
+
+
+def arb_reply(waveid, values):
+    return b":b%02d=" % waveid + b",".join(values) + b",.\r\n"
+
+
+# shadow-register cache
+
+def test_cache_skips_unchanged_writes(awg, port):
+    awg.setamplitude(1, 2.5)
+    transactions = port.transactions
+    awg.setamplitude(1, 2.5)
+    assert port.transactions == transactions
+    awg.setamplitude(1, 3)
+    assert port.transactions == transactions + 1
+    assert port.registers[25] == "3000"
+
+
+def test_cache_answers_reads(awg, port):
+    assert awg.getfrequency(1) == 1000
+    transactions = port.transactions
+    assert awg.getfrequency(1) == 1000
+    assert port.transactions == transactions
+
+
+def test_cache_always_writes_mode(awg, port):
+    awg.setmode("WAVE_CH1")
+    transactions = port.transactions
+    awg.setmode("WAVE_CH1", nostop=True)
+    assert port.transactions == transactions + 1
+    assert awg.getmode() == (0, "WAVE_CH1")
+    assert port.transactions == transactions + 1
+
+
+def test_cache_invalidate(awg, port):
+    awg.getamplitude(1)
+    port.registers[25] = "1500"
+    assert awg.getamplitude(1) == 5
+    awg.cache_invalidate(jds6600.AMPLITUDE1)
+    assert awg.getamplitude(1) == 1.5
+
+
+def test_cache_invalidate_forgets_waveforms(awg, port):
+    wave = np.arange(2048) % 4096
+    awg.arb_setwave(1, wave)
+    transactions = port.transactions
+    awg.arb_setwave(1, wave)
+    assert port.transactions == transactions
+    awg.cache_invalidate()
+    awg.arb_setwave(1, wave)
+    assert port.transactions == transactions + 1
+
+
+def test_cache_sync(awg, port):
+    awg.getamplitude(1)
+    port.registers[25] = "1500"
+    awg.cache_sync()
+    assert awg.getamplitude(1) == 1.5
+
+
+def test_cache_disabled(port):
+    awg = jds6600(port)
+    awg.setamplitude(1, 2.5)
+    transactions = port.transactions
+    awg.setamplitude(1, 2.5)
+    awg.getamplitude(1)
+    assert port.transactions == transactions + 2
+    assert not awg.cache_isenabled()
+
+
+# transactions
+
+def test_transaction_sends_one_write(awg, port):
+    # setfrequency reads the mode, which needs to be in the cache
+    awg.cache_sync()
+    transactions = port.transactions
+    with awg.transaction():
+        awg.setamplitude(1, 1)
+        awg.setoffset(1, 0.5)
+        awg.setfrequency(1, 2000)
+    assert port.transactions == transactions + 1
+    assert (port.registers[25], port.registers[27], port.registers[23]) == ("1000", "1050", "200000,0")
+
+
+def test_transaction_nested(awg, port):
+    transactions = port.transactions
+    with awg.transaction():
+        awg.setamplitude(1, 1)
+        with awg.transaction():
+            awg.setoffset(1, 0.5)
+        assert port.transactions == transactions
+    assert port.transactions == transactions + 1
+
+
+def test_transaction_read_flushes(port):
+    awg = jds6600(port)
+    with awg.transaction():
+        awg.setamplitude(1, 1)
+        assert awg.getamplitude(1) == 1
+
+
+def test_transaction_flush_error_invalidates_cache(awg, port, monkeypatch):
+    fail_writes(port, monkeypatch, b":ok\r\n:error\r\n")
+    with pytest.raises(UnexpectedReplyError):
+        with awg.transaction():
+            awg.setamplitude(1, 1)
+            awg.setoffset(1, 0.5)
+    transactions = port.transactions
+    assert awg.getamplitude(1) == 5
+    assert port.transactions == transactions + 1
+
+
+def test_transaction_port_error_invalidates_cache(awg, port, monkeypatch):
+    fail_writes(port, monkeypatch, serial.SerialException("port gone"))
+    with pytest.raises(serial.SerialException):
+        with awg.transaction():
+            awg.setamplitude(1, 1)
+    transactions = port.transactions
+    assert awg.getamplitude(1) == 5
+    assert port.transactions == transactions + 1
+
+
+def test_transaction_exception_drops_writes(awg, port):
+    transactions = port.transactions
+    with pytest.raises(KeyError):
+        with awg.transaction():
+            awg.setamplitude(1, 1)
+            raise KeyError()
+    assert port.transactions == transactions
+    assert awg.getamplitude(1) == 5
+
+
+# bulk read
+
+def test_getstate(awg, port):
+    port.registers.update({20: "1,0", 21: "0", 22: "2", 23: "123456,1", 24: "5000,0", 25: "2500", 26: "1000",
+                           27: "1100", 28: "950", 29: "250", 30: "500", 31: "900", 33: "4"})
+    transactions = port.transactions
+    state = awg.getstate()
+    assert port.transactions == transactions + 1
+    assert state.channel1 == (True, (0, "SINE"), 1234.56, 2.5, 1, 25)
+    assert state.channel2 == (False, (2, "PULSE"), 50, 1, -0.5, 50)
+    assert state.phase == 90
+    assert state.mode == (4, "MEASURE")
+
+
+def test_getstate_fills_cache(awg, port):
+    awg.getstate()
+    transactions = port.transactions
+    assert awg.getmode() == (0, "WAVE_CH1")
+    assert awg.getfrequency(2) == 1000
+    assert port.transactions == transactions
+
+
+def test_getstate_invalid_enable(awg, port):
+    port.registers[20] = "2,0"
+    with pytest.raises(UnexpectedValueError):
+        awg.getstate()
+
+
+# arbitrary waveforms
+
+@pytest.mark.parametrize("reply, error", [
+    (arb_reply(6, [b"1"] * 2048), FormatError),
+    (arb_reply(5, [b"1"] * 2048)[:-3] + b"\r\n", FormatError),
+    (arb_reply(5, [b"1"] * 2047), UnexpectedValueError),
+    (arb_reply(5, [b"1"] * 2049), UnexpectedValueError),
+    (arb_reply(5, [b"x"] + [b"1"] * 2047), UnexpectedValueError),
+    (arb_reply(5, [b"70000"] + [b"1"] * 2047), UnexpectedValueError),
+    (arb_reply(5, [b"4096"] + [b"1"] * 2047), UnexpectedValueError),
+    (arb_reply(5, [b"-1"] + [b"1"] * 2047), UnexpectedValueError),
+], ids=["other_slot", "no_dot", "too_short", "too_long", "not_a_number", "wraps_uint16", "above_4095", "negative"])
+def test_parsearbwave_errors(awg, reply, error):
+    with pytest.raises(error):
+        awg._jds6600__parsearbwave(5, reply)
+
+
+def test_arbwave_roundtrip(awg):
+    wave = (np.arange(2048) * 2) % 4096
+    awg.arb_setwave(5, wave)
+    read = awg.arb_getwave_array(5)
+    assert read.dtype == np.uint16
+    assert np.array_equal(read, wave)
+    assert awg.arb_getwave(5) == wave.tolist()
+
+
+# retries
+
+def test_no_retries(port, monkeypatch):
+    awg = jds6600(port)
+    fail_writes(port, monkeypatch, b":error\r\n")
+    with pytest.raises(UnexpectedReplyError):
+        awg.setamplitude(1, 1)
+
+
+def test_retry_after_garbled_reply(port, monkeypatch):
+    awg = jds6600(port, retries=2, backoff=0)
+    fail_writes(port, monkeypatch, b":r2")
+    assert awg.getamplitude(1) == 5
+    assert awg.getretries() == (1, 0)
+
+
+def test_retry_after_lost_reply(port, monkeypatch):
+    awg = jds6600(port, retries=2, backoff=0, timeout=0.01)
+    fail_writes(port, monkeypatch, b"")
+    awg.setamplitude(1, 1)
+    assert port.registers[25] == "1000"
+    assert awg.getretries() == (1, 0)
+
+
+def test_retry_gives_up(port, monkeypatch):
+    awg = jds6600(port, retries=2, backoff=0)
+    fail_writes(port, monkeypatch, b":error\r\n", count=3)
+    with pytest.raises(UnexpectedReplyError):
+        awg.setamplitude(1, 1)
+    assert awg.getretries() == (2, 0)
+
+
+def test_resync_drops_late_replies(port, monkeypatch):
+    awg = jds6600(port, retries=1, backoff=0)
+    fail_writes(port, monkeypatch, b":r25=1234.\r\n:ok\r\n")
+    assert awg.getfrequency(1) == 1000
+    assert awg.getamplitude(1) == 5
+
+
+def test_reconnect_after_port_error(awg, port, monkeypatch):
+    awg.setretries(1)
+    awg.getamplitude(1)
+    port.registers[25] = "1500"
+    fail_writes(port, monkeypatch, serial.SerialException("port gone"))
+    assert awg.getfrequency(1) == 1000
+    assert awg.getretries() == (1, 1)
+    assert port.is_open
+    # the cache is not valid after the port was opened again
+    assert awg.getamplitude(1) == 1.5
+
+
+# reading replies
+
+def test_readline_keeps_port_timeout():
+    port = SlowPort()
+    awg = jds6600(port, timeout=1, arbtimeout=2)
+    port.timeout_changes = 0
+    for i in range(25):
+        awg.setamplitude(1, i % 2 + 1)
+        awg.getamplitude(1)
+    assert port.timeout_changes == 0
+    awg.arb_getwave_array(1)
+    awg.getamplitude(1)
+    assert port.timeout_changes == 2
+
+
+def test_readline_reads_shortest_reply_at_once():
+    port = SlowPort()
+    awg = jds6600(port)
+    awg.setamplitude(1, 1)
+    # ":ok" and the remaining "\r\n"
+    assert port.reads == 2
+
+
+def test_readline_timeout():
+    # a line which never ends, arriving byte by byte
+    port = SlowPort(delay=0.01)
+    awg = jds6600(port)
+    port._buffer += b"x" * 10000
+    start = time.monotonic()
+    line = awg._jds6600__readline(0.05)
+    assert time.monotonic() - start < 0.1
+    assert line.startswith(b"xxx") and not line.endswith(b"\n")
+
+
+# parsing of replies
+
+@pytest.mark.parametrize("reply, error", [
+    (b":r23\r\n", FormatError),
+    (b":r24=100000,0.\r\n", FormatError),
+    (b":r23=100000,0\r\n", FormatError),
+    (b":r23=1.0.\r\n", FormatError),
+    (b":r23=1x,0.\r\n", UnexpectedValueError),
+    (b":r23=.\r\n", UnexpectedValueError),
+], ids=["no_equals", "other_register", "no_dot", "two_dots", "not_a_number", "empty"])
+def test_parsereply_errors(awg, reply, error):
+    with pytest.raises(error):
+        awg._jds6600__parsereply(23, reply)
+
+
+def test_parsereply(awg):
+    assert awg._jds6600__parsereply(23, b":r23=100000,0.\r\n") == [100000, 0]
+    assert awg._jds6600__parsereply(25, b":r25=5000.\r\n") == 5000
+
+
+# formatting of commands
+
+def test_sendwritecmd_values(awg, port):
+    awg._jds6600__sendwritecmd(jds6600.AMPLITUDE1, 1500)
+    awg._jds6600__sendwritecmd(jds6600.OFFSET1, b"1100")
+    awg._jds6600__sendwritecmd(jds6600.FREQUENCY1, "2000,1")
+    assert (port.registers[25], port.registers[27], port.registers[23]) == ("1500", "1100", "2000,1")
+    assert (awg.getamplitude(1), awg.getoffset(1), awg.getfrequency(1)) == (1.5, 1, 20)
+    with pytest.raises(TypeError):
+        awg._jds6600__sendwritecmd(jds6600.AMPLITUDE1, 1.5)
@@ -0,0 +1,108 @@
+# test_sweepwriter.py
+# Tests of the result writers and the checkpoint files of sweepwriter.py (run with pytest)
+
+# Jan Böhmer (c) 2019
+# published under MIT license. See file "LICENSE" for full license text
+
+import json
+
+import numpy as np
+import pytest
+
+import sweepwriter
+
+
+def point(freq, volt=1.0):
+    return {"freq": freq, "volt": volt, "phase": None, "settle_time": 0.1, "scale": 1.0, "timebase": 0.001, "timestamp": 1000.0 + freq}
+
+
+# result writers
+
+def test_csv_writer(tmp_path):
+    filename = str(tmp_path / "sweep.csv")
+    with sweepwriter.open_writer(filename, phase=True) as writer:
+        writer.write_point(100, 0.5, -45)
+        writer.write_point(200, None, None)
+    with open(filename) as file:
+        lines = file.read().splitlines()
+    assert lines == ["Frequency in Hz; Amplitude in V; Phase in Degree", "100.000000;0.500000;-45.000000 ", "200.000000;nan;nan "]
+
+
+def test_npz_writer(tmp_path):
+    filename = str(tmp_path / "sweep.npz")
+    with sweepwriter.open_writer(filename, metadata={"voltage": 5}) as writer:
+        writer.write_point(100, 0.5, -45, 0.2, 1.0, 0.001, 1234.5)
+        writer.write_point(200, None)
+    data = np.load(filename)
+    assert data["frequency"].tolist() == [100, 200]
+    assert data["amplitude"][0] == 0.5 and np.isnan(data["amplitude"][1])
+    assert data["timestamp"][0] == 1234.5
+    assert json.loads(str(data["metadata"]))["voltage"] == 5
+    # the temporary file of the points is removed
+    assert not (tmp_path / "sweep.npz.part").exists()
+
+
+def test_open_writer_unknown_extension(tmp_path):
+    with sweepwriter.open_writer(str(tmp_path / "sweep.txt")) as writer:
+        assert isinstance(writer, sweepwriter.CSVWriter)
+
+
+# checkpoints
+
+def test_checkpoint_cycle(tmp_path):
+    filename = str(tmp_path / "sweep.json")
+    sweepwriter.save_checkpoint(filename, {"argv": ["100", "1000"], "complete": False, "scope": {"ch2_scale": 1}})
+    sweepwriter.append_checkpoint(filename, [point(100), point(200)], {"complete": False, "scope": {"ch2_scale": 2}})
+    sweepwriter.append_checkpoint(filename, [point(300)], {"complete": True})
+    state = sweepwriter.load_checkpoint(filename)
+    assert state["argv"] == ["100", "1000"]
+    assert [p["freq"] for p in state["points"]] == [100, 200, 300]
+    assert state["complete"] is True
+    assert state["scope"] == {"ch2_scale": 2}
+
+
+def test_checkpoint_resume_keeps_points(tmp_path):
+    filename = str(tmp_path / "sweep.json")
+    sweepwriter.save_checkpoint(filename, {"complete": False})
+    sweepwriter.append_checkpoint(filename, [point(100), point(200)])
+
+    # a resumed sweep starts the file again with the restored points, nothing is lost before its first checkpoint
+    restored = sweepwriter.load_checkpoint(filename)["points"]
+    sweepwriter.save_checkpoint(filename, {"complete": False, "points": restored})
+    assert sweepwriter.load_checkpoint(filename)["points"] == restored
+
+    sweepwriter.append_checkpoint(filename, [point(300)])
+    assert [p["freq"] for p in sweepwriter.load_checkpoint(filename)["points"]] == [100, 200, 300]
+
+
+def test_checkpoint_ignores_torn_last_line(tmp_path):
+    filename = str(tmp_path / "sweep.json")
+    sweepwriter.save_checkpoint(filename, {"complete": False})
+    sweepwriter.append_checkpoint(filename, [point(100)])
+    with open(filename, "a") as file:
+        file.write(json.dumps({"points": [point(200)], "complete": True})[:20])
+    state = sweepwriter.load_checkpoint(filename)
+    assert [p["freq"] for p in state["points"]] == [100]
+    assert state["complete"] is False
+
+
+def test_checkpoint_broken_line_in_the_middle(tmp_path):
+    filename = str(tmp_path / "sweep.json")
+    sweepwriter.save_checkpoint(filename, {"complete": False})
+    with open(filename, "a") as file:
+        file.write("{\"points\": [\n")
+    sweepwriter.append_checkpoint(filename, [point(100)])
+    with pytest.raises(ValueError):
+        sweepwriter.load_checkpoint(filename)
+
+
+def test_parquet_writer_needs_pyarrow(tmp_path):
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        with pytest.raises(ImportError):
+            sweepwriter.open_writer(str(tmp_path / "sweep.parquet"))
+    else:
+        with sweepwriter.open_writer(str(tmp_path / "sweep.parquet")) as writer:
+            writer.write_point(100, 0.5)
+        assert pyarrow.parquet.read_table(str(tmp_path / "sweep.parquet"))["frequency"].to_pylist() == [100]